@@ -0,0 +1,93 @@
+"""Time log density gradient evaluations of the Stan programs against N.
+
+Each program is given the same synthetic data set (sinusoidal curves for a few
+conditions plus noise) at several numbers of time points, and the mean time of
+a gradient evaluation is reported. Run the script on two checkouts to compare
+revisions of the programs.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+import phenom
+
+PROGRAMS = [
+    "phenom.stan",
+    "phenom_deriv.stan",
+    "phenom_marginal.stan",
+    "phenom_sufficient.stan",
+    "phenom_sparse.stan",
+]
+
+
+def synthetic(n, replicates=4, conditions=4, seed=0):
+    """Growth-like curves for several conditions, replicates per condition."""
+    rng = np.random.RandomState(seed)
+    x = np.linspace(0, 48, n)
+
+    meta = pd.DataFrame(
+        {"condition": np.repeat(np.arange(conditions), replicates)}
+    )
+    y = np.column_stack(
+        [
+            np.sin(x / 48 * np.pi * (1 + c / conditions)) + rng.normal(0, 0.1, n)
+            for c in meta.condition
+        ]
+    )
+
+    return phenom.dataset.DataSet(pd.DataFrame(y, index=x), meta)
+
+
+def point(cfg):
+    """A parameter value inside the support of every program."""
+    return {
+        "lengthscale": [(cfg["ls_min"] + cfg["ls_max"]) / 2] * cfg["L"],
+        "alpha": [1.0] * cfg["L"],
+        "sigma": 1.0,
+        "marginal_alpha": 1.0,
+        "marginal_lengthscale": (cfg["ls_min"] + cfg["ls_max"]) / 2,
+        "f_eta": np.zeros((cfg["K"], cfg["N"])),
+    }
+
+
+def gradient(program, n, repeats=20):
+    """Mean seconds per gradient evaluation of program for n time points."""
+    ds = synthetic(n)
+    design = phenom.design.Formula(ds.meta, "C(condition)")
+    phen = phenom.phenotype.Phenotype(
+        ds.data, design, model=program, maxExpectedCross=3, minExpectedCross=0.1
+    )
+
+    cfg = phen.config()
+    fit = phen.model.sampling(
+        data=cfg, iter=1, chains=1, algorithm="Fixed_param", init=[point(cfg)]
+    )
+    upars = fit.unconstrain_pars(point(cfg))
+
+    # warm up allocations before timing
+    fit.grad_log_prob(upars)
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fit.grad_log_prob(upars)
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--program", action="append", choices=PROGRAMS)
+    parser.add_argument("-N", type=int, nargs="+", default=[25, 50, 100, 200])
+    parser.add_argument("--repeats", type=int, default=20)
+
+    args = parser.parse_args()
+
+    print("program,N,seconds")
+    for program in args.program or PROGRAMS:
+        for n in args.N:
+            print(
+                "{},{},{:.6g}".format(program, n, gradient(program, n, args.repeats)),
+                flush=True,
+            )
@@ -0,0 +1,70 @@
+"""Time importing phenom in a fresh interpreter.
+
+Each statement is run in new Python processes, timed from inside the process,
+and the median time is reported together with the heavy third party packages
+the statement loaded. Run the script on two checkouts to compare revisions.
+"""
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+STATEMENTS = [
+    "import phenom",
+    "from phenom.dataset import DataSet",
+    "import phenom; phenom.DataSet",
+    "import phenom; phenom.design.Formula",
+    "import phenom; phenom.phenotype.Phenotype",
+]
+
+PACKAGES = ["pandas", "patsy", "pystan", "matplotlib", "scipy"]
+
+# run in the child, reports its own import time and loaded packages
+PROGRAM = """
+import sys, time
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(seconds, *[p for p in {packages!r} if p in sys.modules])
+"""
+
+
+def measure(statement, repeats=10):
+    """Median seconds to run statement in a fresh interpreter, and the packages it loaded."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(
+        os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get("PYTHONPATH", "")])
+    )
+
+    times = []
+    for _ in range(repeats):
+        out = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                PROGRAM.format(statement=statement, packages=PACKAGES),
+            ],
+            env=env,
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        ).stdout.split()
+        times.append(float(out[0]))
+
+    return np.median(times), out[1:]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--statement", action="append")
+    parser.add_argument("--repeats", type=int, default=10)
+
+    args = parser.parse_args()
+
+    print("statement,seconds,loaded")
+    for statement in args.statement or STATEMENTS:
+        seconds, loaded = measure(statement, args.repeats)
+        print('"{}",{:.4f},{}'.format(statement, seconds, " ".join(loaded)), flush=True)
@@ -0,0 +1,299 @@
+"""Time each stage of a phenom analysis on synthetic data sets.
+
+For every combination of N (time points), P (wells per plate), number of
+plates, design (see synthetic.DESIGNS) and Stan program, a data set is drawn
+with benchmarks.synthetic and the stages below are timed in order:
+
+    concat       DataSet.concat_many of the plates
+    design       design matrix, priors, names and sparse matrix
+    config       Phenotype.config, including normalization
+    compile      Phenotype.model, loaded from phenom.cache when present
+    gradient     one log density gradient evaluation
+    sampling     Phenotype.samples
+    save         Phenotype.save of the posterior
+    derivatives  Phenotype.derivatives of the posterior
+
+Stages after sampling use the sampled posterior, or draws scattered around the
+truth when sampling is skipped, so they can be timed without pystan
+(--skip compile --skip gradient --skip sampling). Cheap
+stages are repeated and their median time reported. Results are written as
+JSON, with the revision and package versions they were measured with, to
+track regressions across versions:
+
+    python -m benchmarks.pipeline -N 50 100 -P 24 --plates 1 4 -o results.json
+
+Set PHENOM_CACHE to an empty directory to time cold compiles.
+"""
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import product
+
+import numpy as np
+
+from . import synthetic
+
+STAGES = [
+    "concat",
+    "design",
+    "config",
+    "compile",
+    "gradient",
+    "sampling",
+    "save",
+    "derivatives",
+]
+
+# stages run once whatever the number of repeats
+ONCE = ["compile", "sampling"]
+
+# every Stan program shipped with phenom
+PROGRAMS = sorted(
+    f
+    for f in os.listdir(
+        os.path.join(os.path.dirname(os.path.dirname(__file__)), "phenom", "stan")
+    )
+    if f.endswith(".stan")
+)
+
+
+def timed(f, repeats=1):
+    """Median seconds of repeats calls of f, and the result of the last."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = f()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)), result
+
+
+def environment():
+    """Revision and versions the results were measured with."""
+    import pandas
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=root,
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    try:
+        import pystan
+
+        pystan_version = pystan.__version__
+    except ImportError:
+        pystan_version = None
+
+    return {
+        "revision": revision,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pandas.__version__,
+        "pystan": pystan_version,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "created": time.time(),
+    }
+
+
+def posterior(truth, L, draws=100, seed=0):
+    """A fit of draws scattered around the truth, standing in for a sampled posterior.
+
+    L: number of priors of the design
+    """
+    from phenom.fit import Fit
+
+    rng = np.random.RandomState(seed)
+    f = truth["f"]
+
+    return Fit(
+        {
+            "f": f + rng.normal(0, 0.1, (draws,) + f.shape),
+            "alpha": np.abs(rng.normal(truth["alpha"], 0.1, (draws, L))),
+            "lengthscale": np.abs(rng.normal(truth["lengthscale"], 0.02, (draws, L))),
+            "sigma": np.abs(rng.normal(truth["sigma"], 0.01, draws)),
+        },
+        "synthetic",
+    )
+
+
+def start(stanfit, cfg):
+    """A value of the parameters of any program, to evaluate its gradient at.
+
+    Parameters gradient.point knows take its value, others (e.g. the basis
+    weights of phenom_hsgp.stan) the value of the draw of stanfit.
+    """
+    from .gradient import point
+
+    draw = {k: v[0] for k, v in stanfit.extract().items() if k != "lp__"}
+    draw.update({k: v for k, v in point(cfg).items() if k in draw})
+
+    return draw
+
+
+def run(
+    N,
+    P,
+    plates,
+    kind,
+    program,
+    stages=STAGES,
+    repeats=5,
+    chains=4,
+    iterations=1000,
+    seed=0,
+):
+    """Seconds taken by each of stages for one data set and program."""
+    from phenom.dataset import DataSet
+    from phenom.phenotype import Phenotype
+
+    datasets, truth = synthetic.draw(N, P, plates, kind, seed=seed)
+    results = {}
+
+    def stage(name, f):
+        if name in stages:
+            results[name], value = timed(f, 1 if name in ONCE else repeats)
+        else:
+            value = f()
+        return value
+
+    ds = stage("concat", lambda: DataSet.concat_many(datasets))
+
+    def build():
+        # each property is computed once per design, so time a new one
+        d = synthetic.design(ds.meta, kind)
+        d.matrix, d.priors, d.names, d.sparse
+        return d
+
+    design = stage("design", build)
+
+    def phenotype():
+        return Phenotype(
+            ds.data, design, model=program, maxExpectedCross=3, minExpectedCross=0.1
+        )
+
+    phen = phenotype()
+    cfg = stage("config", lambda: phenotype().config())
+
+    samp = None
+    if {"compile", "gradient", "sampling"} & set(stages):
+        stage("compile", lambda: phen.model)
+
+    if "gradient" in stages:
+        with phen.threading():
+            fit = phen.model.sampling(
+                data=cfg, iter=1, chains=1, algorithm="Fixed_param", init="0"
+            )
+            upars = fit.unconstrain_pars(start(fit, cfg))
+
+            # warm up allocations before timing
+            fit.grad_log_prob(upars)
+            stage("gradient", lambda: fit.grad_log_prob(upars))
+
+    if "sampling" in stages:
+        samp = stage(
+            "sampling",
+            lambda: phen.samples(chains=chains, iter=iterations, seed=seed),
+        )
+    else:
+        samp = posterior(truth, design.L, seed=seed)
+        phen.posteriors.append(samp)
+
+    if "save" in stages:
+        d = tempfile.mkdtemp()
+        try:
+            stage("save", lambda: phen.save(d))
+        finally:
+            shutil.rmtree(d)
+
+    if "derivatives" in stages:
+        draws = samp.extract(["f", "alpha", "lengthscale"])
+        stage("derivatives", lambda: phen.derivatives(draws, random_state=seed))
+
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-N", type=int, nargs="+", default=[50, 100])
+    parser.add_argument("-P", type=int, nargs="+", default=[24])
+    parser.add_argument("--plates", type=int, nargs="+", default=[1, 4])
+    parser.add_argument(
+        "--design", nargs="+", choices=synthetic.DESIGNS, default=synthetic.DESIGNS
+    )
+    parser.add_argument(
+        "--program", nargs="+", choices=PROGRAMS, default=["phenom.stan"]
+    )
+    parser.add_argument("--stage", action="append", choices=STAGES)
+    parser.add_argument("--skip", action="append", choices=STAGES, default=[])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--chains", type=int, default=4)
+    parser.add_argument("--iter", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "-o", "--output", help="JSON file, standard output if not given"
+    )
+
+    args = parser.parse_args()
+    stages = [s for s in args.stage or STAGES if s not in args.skip]
+
+    results = []
+    for n, p, plates, kind, program in product(
+        args.N, args.P, args.plates, args.design, args.program
+    ):
+        seconds = run(
+            n,
+            p,
+            plates,
+            kind,
+            program,
+            stages,
+            repeats=args.repeats,
+            chains=args.chains,
+            iterations=args.iter,
+            seed=args.seed,
+        )
+        for name, s in seconds.items():
+            results.append(
+                {
+                    "N": n,
+                    "P": p,
+                    "plates": plates,
+                    "design": kind,
+                    "program": program,
+                    "stage": name,
+                    "seconds": s,
+                }
+            )
+            print(
+                "{},{},{},{},{},{},{:.6g}".format(n, p, plates, kind, program, name, s),
+                file=sys.stderr,
+                flush=True,
+            )
+
+    report = {
+        "environment": environment(),
+        "arguments": vars(args),
+        "results": results,
+    }
+
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as fh:
+            json.dump(report, fh, indent=2)
@@ -0,0 +1,115 @@
+"""Synthetic growth curve data sets drawn from known gaussian processes.
+
+Wells are spread over plates, each plate holding every combination of strain
+and condition, and every design function is drawn from a squared exponential
+GP with known hyperparameters. The observations are the design applied to the
+functions plus gaussian noise, so a data set of any size can be generated
+without the plate data under data/, along with the truth it was drawn from.
+"""
+import numpy as np
+import pandas as pd
+
+from phenom.dataset import DataSet
+
+# design expressions by name, see design()
+DESIGNS = ["formula", "add", "kron"]
+
+
+def meta(P, plates=1, strains=2, conditions=4):
+    """Well annotations of P wells on each of plates plates."""
+    wells = np.arange(P)
+
+    return [
+        pd.DataFrame(
+            {
+                "plate": plate,
+                "well": wells,
+                "strain": wells % strains,
+                "condition": (wells // strains) % conditions,
+            }
+        )
+        for plate in range(plates)
+    ]
+
+
+def design(meta, kind="formula"):
+    """A design of increasing complexity over the wells described by meta.
+
+    formula: strain and condition effects
+    add: the same, plus an effect of each plate
+    kron: strain and condition effects repeated globally and on each plate
+    """
+    from phenom.design import Formula
+
+    treatment = Formula(meta, "C(strain) + C(condition)")
+
+    if kind == "formula":
+        return treatment
+    if kind == "add":
+        return treatment + Formula(meta, "C(plate) + 0")
+    if kind == "kron":
+        return treatment * (Formula(meta, "1") + Formula(meta, "C(plate) + 0"))
+
+    raise ValueError("unknown design %s, expected one of %s" % (kind, DESIGNS))
+
+
+def kernel(x, alpha, lengthscale):
+    """Squared exponential covariance of x (on [0, 1])."""
+    return alpha ** 2 * np.exp(-0.5 * (x[:, None] - x[None, :]) ** 2 / lengthscale ** 2)
+
+
+def draw(
+    N=50,
+    P=24,
+    plates=1,
+    kind="formula",
+    alpha=1.0,
+    lengthscale=0.2,
+    sigma=0.1,
+    hours=48.0,
+    seed=0,
+):
+    """One DataSet per plate, as loaded from separate plate reader exports.
+
+    P wells on each of plates plates are observed at N time points over
+    hours. Returns the data sets and the truth: the time points on [0, 1],
+    the functions f (K, N), and the hyperparameters used to draw them.
+    """
+    rng = np.random.RandomState(seed)
+    x = np.linspace(0, 1, N)
+
+    m = pd.concat(meta(P, plates), ignore_index=True)
+    dm = design(m, kind)
+
+    cov = kernel(x, alpha, lengthscale) + 1e-8 * np.eye(N)
+    f = rng.multivariate_normal(np.zeros(N), cov, size=dm.k)
+
+    # the mean of the first, intercept, function gives the curves an offset
+    f[0] += 1
+    y = dm.matrix.dot(f) + rng.normal(0, sigma, (dm.n, N))
+
+    datasets = [
+        DataSet(
+            pd.DataFrame(y[(m.plate == p).values].T, index=x * hours),
+            m[m.plate == p].copy(),
+        )
+        for p in range(plates)
+    ]
+
+    truth = {
+        "x": x,
+        "f": f,
+        "alpha": alpha,
+        "lengthscale": lengthscale,
+        "sigma": sigma,
+    }
+
+    return datasets, truth
+
+
+def generate(N=50, P=24, plates=1, kind="formula", **kwargs):
+    """A single DataSet of all plates, its design and the truth, see draw."""
+    datasets, truth = draw(N, P, plates, kind, **kwargs)
+    ds = DataSet.concat_many(datasets)
+
+    return ds, design(ds.meta, kind), truth
@@ -1,7 +1,6 @@
-import time
-import datetime
 import pandas as pd
 from glob import glob
+from concurrent.futures import ProcessPoolExecutor
 import os
 
 
@@ -16,33 +15,44 @@ def parse(data):
     return data.set_index("Time")
 
 
+# [days ]hours:minutes:seconds, days are whole days elapsed
+TIME = r"^\s*(?:(?P<days>\d+)\s+)?(?P<hours>\d+):(?P<minutes>\d+):(?P<seconds>\d+)\s*$"
+
+
 def convert_time(time, r=2):
-    time = time.apply(_parse_time)
-    time = time.apply(_convert_delta_to_hours, args=(time[0],))
+    """Hours since the first time point, rounded to r decimals."""
+    parts = time.astype(str).str.extract(TIME)
+
+    if parts[["hours", "minutes", "seconds"]].isnull().any().any():
+        raise Exception("Time format unknown")
+
+    days = parts["days"].fillna(0).astype(int).values
+    hours, minutes, seconds = [
+        parts[c].astype(int).values for c in ["hours", "minutes", "seconds"]
+    ]
+
+    # ranges the datetime of a day prefix d, the (d + 1)th of January, accepts
+    if (
+        (parts["days"].notnull().values & ((days < 1) | (days > 30))).any()
+        or (hours > 23).any()
+        or (minutes > 59).any()
+        or (seconds > 59).any()
+    ):
+        raise Exception("Time format unknown")
+
+    total = days * 86400 + hours * 3600 + minutes * 60 + seconds
+    delta = total - total[0]
+
+    # whole days and the remaining seconds, as datetime.timedelta splits them
+    time = pd.Series(
+        24 * (delta // 86400) + (delta % 86400) / 3600.0,
+        index=time.index,
+        name=time.name,
+    )
     time = time.round(r)
     return time
 
 
-def _convert_delta_to_hours(time, t0):
-    delta = time - t0
-    # return delta
-    return 24 * delta.days + float(delta.seconds) / 3600
-
-
-def _parse_time(t):
-    try:
-        return datetime.datetime(*time.struct_time(time.strptime(t, "%H:%M:%S"))[:-2])
-    except ValueError:
-        try:
-            t = time.strptime(t, "%d %H:%M:%S")
-            t = list(t)
-            t[2] += 1
-
-            return datetime.datetime(*time.struct_time(t)[:-2])
-        except ValueError:
-            raise Exception("Time format unknown")
-
-
 def save(data, key, sel, path):
     assert data.shape[1] == key.shape[0]
     data = data.loc[:, sel.values]
@@ -52,48 +62,57 @@ def save(data, key, sel, path):
     key.to_csv(os.path.join(path, "meta.csv"))
 
 
+def process(d):
+    """Parse the plate in directory d and save its standard, low and hi oxidative subsets."""
+    data = glob(os.path.join(d, "*.csv"))[0]
+    key = glob(os.path.join(d, "*key.xlsx"))[0]
+
+    print("Reading in {} and {}.".format(data, key))
+
+    data = parse(pd.read_csv(data, encoding="utf-16"))
+
+    # remove spaces in filename
+    d = d.replace(" ", "_")
+
+    key = pd.read_excel(key)
+    key["plate"] = d
+
+    # print(data.head())
+    # print(key.head())
+    # print(data.columns)
+    # print()
+
+    # standard
+    path = os.path.join("../../standard/", d)
+    os.makedirs(path, exist_ok=True)
+    sel = (key["mM PQ"] == 0.0) & (key.Strain == "ura3")
+    if "M NaCl" in key:
+        sel = sel & (key["M NaCl"] == 4.2)
+    save(data, key, sel, path)
+
+    # low
+    path = os.path.join("../../low-oxidative/", d)
+    os.makedirs(path, exist_ok=True)
+    sel = ((key["mM PQ"] == 0.0) | (key["mM PQ"] == 0.083)) & (key.Strain == "ura3")
+    if "M NaCl" in key:
+        sel = sel & (key["M NaCl"] == 4.2)
+    save(data, key, sel, path)
+
+    # hi
+    path = os.path.join("../../hi-oxidative/", d)
+    os.makedirs(path, exist_ok=True)
+    sel = ((key["mM PQ"] == 0.0) | (key["mM PQ"] == 0.333)) & (key.Strain == "ura3")
+    if "M NaCl" in key:
+        sel = sel & (key["M NaCl"] == 4.2)
+    save(data, key, sel, path)
+
+    return d
+
+
 if __name__ == "__main__":
     src = glob("*/")
 
-    for d in src:
-        data = glob(os.path.join(d, "*.csv"))[0]
-        key = glob(os.path.join(d, "*key.xlsx"))[0]
-
-        print("Reading in {} and {}.".format(data, key))
-
-        data = parse(pd.read_csv(data, encoding="utf-16"))
-
-        # remove spaces in filename
-        d = d.replace(" ", "_")
-
-        key = pd.read_excel(key)
-        key["plate"] = d
-
-        # print(data.head())
-        # print(key.head())
-        # print(data.columns)
-        # print()
-
-        # standard
-        path = os.path.join("../../standard/", d)
-        os.makedirs(path, exist_ok=True)
-        sel = (key["mM PQ"] == 0.0) & (key.Strain == "ura3")
-        if "M NaCl" in key:
-            sel = sel & (key["M NaCl"] == 4.2)
-        save(data, key, sel, path)
-
-        # low
-        path = os.path.join("../../low-oxidative/", d)
-        os.makedirs(path, exist_ok=True)
-        sel = ((key["mM PQ"] == 0.0) | (key["mM PQ"] == 0.083)) & (key.Strain == "ura3")
-        if "M NaCl" in key:
-            sel = sel & (key["M NaCl"] == 4.2)
-        save(data, key, sel, path)
-
-        # hi
-        path = os.path.join("../../hi-oxidative/", d)
-        os.makedirs(path, exist_ok=True)
-        sel = ((key["mM PQ"] == 0.0) | (key["mM PQ"] == 0.333)) & (key.Strain == "ura3")
-        if "M NaCl" in key:
-            sel = sel & (key["M NaCl"] == 4.2)
-        save(data, key, sel, path)
+    # plates are independent, parse them in parallel
+    with ProcessPoolExecutor() as pool:
+        for d in pool.map(process, src):
+            print("Saved {}.".format(d))
@@ -1,7 +1,14 @@
 import pandas as pd
 import numpy as np
+import hashlib
+import inspect
+import pickle
 import re
 import os
+from concurrent.futures import ProcessPoolExecutor
+
+# parsed workbooks, keyed on their content, the parse arguments and the parser
+CACHE = ".cache"
 
 
 def parseFile(f, strain=None, header=0):
@@ -13,7 +20,7 @@ def parseFile(f, strain=None, header=0):
         if re.match("(pH ?[0-9.]+,? [0-7.]+ ?(mM)?)|(All pH 0 mM)", s)
     ]
 
-    data = meta = None
+    data, meta = [], []
 
     for s in useSheets:
 
@@ -43,18 +50,13 @@ def parseFile(f, strain=None, header=0):
         if strain is not None:
             newmeta["strain"] = strain
 
-        if meta is None:
-            meta = newmeta
-        else:
-            meta = pd.concat((meta, newmeta), 0)
+        meta.append(newmeta)
 
-        if data is None:
-            data = temp
-        else:
-            if header is None:
-                data = pd.merge(data, temp, on=0)
-            else:
-                data = pd.merge(data, temp, on="Time (hours)")
+        # sheets are joined on their time column
+        data.append(temp.set_index(temp.columns[0]))
+
+    meta = pd.concat(meta, axis=0)
+    data = pd.concat(data, axis=1, join="inner").reset_index()
 
     data.columns = ["time"] + np.arange(data.shape[1] - 1).tolist()
     meta.index = range(meta.shape[0])
@@ -63,12 +65,52 @@ def parseFile(f, strain=None, header=0):
     return data, meta
 
 
+def load(f, strain=None, header=0):
+    """parseFile, reusing the result of an earlier run if neither the workbook nor parseFile changed."""
+
+    h = hashlib.sha256()
+    with open(f, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            h.update(block)
+    h.update(repr((strain, header)).encode("utf-8"))
+
+    # a changed parser, or pandas, invalidates every entry
+    h.update(inspect.getsource(parseFile).encode("utf-8"))
+    h.update(pd.__version__.encode("utf-8"))
+
+    path = os.path.join(CACHE, h.hexdigest() + ".pkl")
+    if os.path.exists(path):
+        with open(path, "rb") as fh:
+            return pickle.load(fh)
+
+    result = parseFile(f, strain, header)
+
+    os.makedirs(CACHE, exist_ok=True)
+    tmp = path + ".%d.tmp" % os.getpid()
+    with open(tmp, "wb") as fh:
+        pickle.dump(result, fh)
+    os.replace(tmp, path)
+
+    return result
+
+
+def plate(target, strain, acid, header):
+    data, meta = load("{}.xlsx".format(target), strain, header)
+
+    meta["acid"] = acid
+    meta["genus"] = "pseudomonas"
+    meta["strain"] = strain
+    meta["plate"] = target
+    meta.index = range(meta.shape[0])
+
+    return data, meta
+
+
 if __name__ == "__main__":
 
     from collections import defaultdict
 
-    datasets = defaultdict(list)
-    for target, strain, acid, header in [
+    plates = [
         ("PA1054 Sodium Benzoate", "PA1054", "sodium-benzoate", 0),
         ("PA1054 Citric Acid", "PA1054", "citric", 0),
         ("PA1054 Potassium Sorbate", "PA1054", "potassium-sorbate", 0),
@@ -91,28 +133,21 @@ if __name__ == "__main__":
         ("PA01 Citric rerun 11.07.17", "PA01", "citric", None),
         ("PA01 Lactic repeat 13.07.17", "PA01", "lactic", None),
         ("PA01 Malic repeat 27.07.17", "PA01", "malic", None),
-    ]:
-        data, meta = parseFile("{}.xlsx".format(target), strain, header)
+    ]
 
-        meta["acid"] = acid
-        meta["genus"] = "pseudomonas"
-        meta["strain"] = strain
-        meta["plate"] = target
-        meta.index = range(meta.shape[0])
+    # workbooks are parsed in parallel, only those changed since the last run
+    with ProcessPoolExecutor() as pool:
+        parsed = list(pool.map(plate, *zip(*plates)))
 
+    datasets = defaultdict(list)
+    for (target, strain, acid, header), (data, meta) in zip(plates, parsed):
         d = "%s-%s" % (strain, acid)
 
         datasets[d].append((data, meta))
 
     for d, sets in datasets.items():
-        data = meta = None
-        for dd, m in sets:
-            if data is None:
-                data = dd
-                meta = m
-            else:
-                data = pd.concat((data, dd), axis=1)
-                meta = pd.concat((meta, m))
+        data = pd.concat([dd for dd, _ in sets], axis=1)
+        meta = pd.concat([m for _, m in sets])
 
         data = data.set_axis(np.arange(data.shape[1]), axis=1)
 
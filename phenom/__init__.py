@@ -1,4 +1,31 @@
-from . import design
-from . import phenotype
-from .dataset import DataSet
-from . import plot
+import importlib
+
+# submodules, and the names they provide, are imported on first access so
+# that e.g. a DataSet can be used without loading patsy, pystan or matplotlib
+_submodules = [
+    "approx",
+    "cache",
+    "dataset",
+    "derivative",
+    "design",
+    "diagnostics",
+    "fit",
+    "phenotype",
+    "plot",
+    "posterior",
+    "results",
+    "runner",
+]
+_attributes = {"DataSet": "dataset"}
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module("." + name, __name__)
+    if name in _attributes:
+        return getattr(importlib.import_module("." + _attributes[name], __name__), name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + _submodules + list(_attributes))
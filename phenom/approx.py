@@ -1,40 +1,196 @@
 import attr
-import GPy
 import numpy as np
 
 
 @attr.s
-class Approx():
+class Kronecker():
+    """Gaussian process regression of curves observed on a shared time grid.
+
+    The covariance of y (N time points x P replicates) is Kd (x) Kx + noise,
+    with a squared exponential kernel Kx over time and a linear kernel over the
+    design rows, Kd = sum_l variance[l] * D_l D_l^T for the columns D_l of each
+    prior. This is the sum over design columns of independent processes with
+    variance[l] * Kx, i.e. the phenom model with its hyperparameters fit by
+    maximum marginal likelihood.
+
+    Eigendecompositions of Kx and Kd diagonalize the full NP x NP covariance,
+    so training costs O(N^3 + P^3) rather than O(N^3 P^3).
+    """
+
+    x = attr.ib()
+    design = attr.ib()
+    y = attr.ib()
+    priors = attr.ib()
+
+    lengthscale = attr.ib(default=0.1)
+    variance = attr.ib(default=None)
+    noise = attr.ib(default=0.1)
+
+    def __attrs_post_init__(self):
+        self.x = np.asarray(self.x, dtype=float)
+        self.design = np.asarray(self.design, dtype=float)
+        self.y = np.asarray(self.y, dtype=float)
+        self.priors = np.asarray(self.priors).astype(int)
+
+        if self.variance is None:
+            self.variance = np.ones(self.priors.max() + 1)
+        self.variance = np.asarray(self.variance, dtype=float)
+
+        self.dist2 = (self.x[:, None] - self.x[None, :]) ** 2
+
+        # design kernel of each prior, Kd is their weighted sum
+        self.gram = np.array(
+            [
+                self.design[:, self.priors == l] @ self.design[:, self.priors == l].T
+                for l in range(self.variance.shape[0])
+            ]
+        )
 
-    phenotype = attr.ib()
-    x_kernel = attr.ib(default=GPy.kern.RBF)
+    @property
+    def params(self):
+        """Log hyperparameters: lengthscale, variance of each prior, noise."""
+        return np.log(np.concatenate(([self.lengthscale], self.variance, [self.noise])))
 
-    def kernels(self):
-        kx = self.x_kernel(1)
+    @params.setter
+    def params(self, value):
+        value = np.exp(value)
+        self.lengthscale = value[0]
+        self.variance = value[1:-1]
+        self.noise = value[-1]
 
-        kdesign = None
-        for i in range(self.phenotype.design.L):
+    def kx(self):
+        return np.exp(-0.5 * self.dist2 / self.lengthscale ** 2)
 
-            # select indices that belong to this prior
-            ind, = np.where(self.phenotype.design.priors == i)
+    def kd(self):
+        return np.tensordot(self.variance, self.gram, 1)
 
-            if kdesign is None:
-                kdesign = GPy.kern.Linear(
-                    ind.shape[0], active_dims=ind, ARD=False)
-            else:
-                ktmp = GPy.kern.Linear(
-                    ind.shape[0], active_dims=ind, ARD=False)
-                kdesign = kdesign + ktmp
+    def _decompose(self):
+        Kx, Kd = self.kx(), self.kd()
 
-        return kx, kdesign
+        sx, Ux = np.linalg.eigh(Kx)
+        sd, Ud = np.linalg.eigh(Kd)
+        sx, sd = np.clip(sx, 0, None), np.clip(sd, 0, None)
 
-    def model(self, optimize=True):
-        kx, kdesign = self.kernels()
+        # eigenvalues of the full covariance, one per (time, replicate) pair
+        lam = sx[:, None] * sd[None, :] + self.noise
+
+        # y and K^{-1} y, in the eigenbasis and as N x P matrices
+        yrot = Ux.T @ self.y @ Ud
+        alpha = Ux @ (yrot / lam) @ Ud.T
+
+        return Kx, Kd, sx, Ux, sd, Ud, lam, yrot, alpha
+
+    def log_likelihood(self):
+        return self._log_likelihood(self._decompose())
+
+    def gradient(self):
+        """Gradient of the log marginal likelihood with respect to params."""
+        return self._gradient(self._decompose())
+
+    def _value_and_grad(self):
+        """Log marginal likelihood and its gradient, from a single decomposition."""
+        decomposition = self._decompose()
+        return self._log_likelihood(decomposition), self._gradient(decomposition)
 
+    def _log_likelihood(self, decomposition):
+        _, _, _, _, _, _, lam, yrot, _ = decomposition
+
+        return -0.5 * (
+            np.log(lam).sum() + (yrot ** 2 / lam).sum() + lam.size * np.log(2 * np.pi)
+        )
+
+    def _gradient(self, decomposition):
+        Kx, Kd, sx, Ux, sd, Ud, lam, _, alpha = decomposition
+
+        # d log p / dK = 0.5 * (alpha alpha^T - K^{-1}), contracted with the
+        # derivative of each kernel factor
+        def grad_x(dKx):
+            quad = (alpha * (dKx @ alpha @ Kd)).sum()
+            trace = (np.einsum("ij,ji->i", Ux.T, dKx @ Ux)[:, None] * sd / lam).sum()
+            return 0.5 * (quad - trace)
+
+        def grad_d(dKd):
+            quad = (alpha * (Kx @ alpha @ dKd)).sum()
+            trace = (sx[:, None] * np.einsum("ij,ji->i", Ud.T, dKd @ Ud) / lam).sum()
+            return 0.5 * (quad - trace)
+
+        grad = [grad_x(Kx * self.dist2 / self.lengthscale ** 3) * self.lengthscale]
+        grad += [grad_d(g) * v for g, v in zip(self.gram, self.variance)]
+        grad += [0.5 * ((alpha ** 2).sum() - (1 / lam).sum()) * self.noise]
+
+        return np.array(grad)
+
+    def optimize(self, bounds=(-10, 10), **kwargs):
+        """Maximize the marginal likelihood over params with L-BFGS.
+
+        bounds limits every log hyperparameter, keeping the kernels
+        numerically well defined during the line search.
+        """
+        import scipy.optimize
+
+        def objective(params):
+            self.params = params
+            value, grad = self._value_and_grad()
+            return -value, -grad
+
+        res = scipy.optimize.minimize(
+            objective,
+            self.params,
+            jac=True,
+            method="L-BFGS-B",
+            bounds=[bounds] * self.params.shape[0],
+            **kwargs
+        )
+        self.params = res.x
+
+        return res
+
+    def predict(self, design):
+        """Latent function mean and variance at x for each row of design.
+
+        Returns two N x M arrays for M design rows.
+        """
+        design = np.atleast_2d(design)
+        Kx, _, sx, Ux, sd, Ud, lam, _, alpha = self._decompose()
+
+        # cross covariance of the new design rows with the training rows
+        cross = sum(
+            v * design[:, self.priors == l] @ self.design[:, self.priors == l].T
+            for l, v in enumerate(self.variance)
+        )
+        prior = sum(
+            v * (design[:, self.priors == l] ** 2).sum(1)
+            for l, v in enumerate(self.variance)
+        )
+
+        mu = Kx @ alpha @ cross.T
+
+        bx = (Ux.T @ Kx) ** 2
+        bd = (Ud.T @ cross.T) ** 2
+        var = np.diag(Kx)[:, None] * prior[None, :] - bx.T @ (1 / lam) @ bd
+
+        return mu, var
+
+    def functions(self):
+        """Posterior mean of every latent function (one per design column), K x N."""
+        Kx, _, _, _, _, _, _, _, alpha = self._decompose()
+
+        return self.variance[self.priors][:, None] * (Kx @ alpha @ self.design).T
+
+
+@attr.s
+class Approx():
+
+    phenotype = attr.ib()
+
+    def model(self, optimize=True):
         cfg = self.phenotype.config()
 
-        m = GPy.models.GPKroneckerGaussianRegression(
-            cfg['x'][:, None], cfg['design'], cfg['y'].T, kx, kdesign
+        m = Kronecker(
+            cfg["x"],
+            cfg.get("design", self.phenotype.design.matrix),
+            cfg["y"].T,
+            self.phenotype.design.priors,
         )
 
         if optimize:
@@ -50,16 +206,8 @@ class Approx():
 
         u = np.unique(design.matrix[:, priors == p], axis=0)
 
-        mus = []
-        vars = []
-
-        for i in range(u.shape[0]):
-            predx2 = np.zeros((1, design.matrix.shape[1]))
-            predx2[0, ind] = u[i, :]
-
-            mu, var = m.predict(m.X1, predx2)
-
-            mus.append(mu[:, 0])
-            vars.append(var[:, 0])
+        # all unique design rows of this prior in one prediction
+        pred = np.zeros((u.shape[0], design.matrix.shape[1]))
+        pred[:, ind] = u
 
-        return np.column_stack(mus), np.column_stack(var)
+        return m.predict(pred)
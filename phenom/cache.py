@@ -0,0 +1,364 @@
+"""On-disk cache of compiled Stan models and, optionally, of their posteriors.
+
+Compiled models are pickled under ``<root>/models`` and keyed on a hash of the
+Stan source and the toolchain that built them, so only the first process to
+request a program pays the compile cost. The cache root defaults to
+``~/.cache/phenom`` and can be moved with the ``PHENOM_CACHE`` environment
+variable.
+
+Posteriors sampled with ``Phenotype.samples(memoize=True)`` are stored under
+``<root>/posteriors`` in the format of phenom.posterior, keyed on the model
+data, the Stan source and the sampler arguments, so an identical rerun
+loads the earlier draws instead of sampling again. Entries can be listed and
+removed from the command line:
+
+    python -m phenom.cache list
+    python -m phenom.cache purge [key ...]
+"""
+import fcntl
+import hashlib
+import json
+import os
+import pickle
+import platform
+import shutil
+import sys
+import sysconfig
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# number of compiled models kept on disk, least recently used are evicted first
+MAX_MODELS = 16
+
+# bytes of cached posteriors kept on disk, least recently used are evicted first
+MAX_POSTERIOR_BYTES = 4 * 2 ** 30
+
+# models already loaded by this process, keyed like the files on disk
+_models = {}
+
+
+def root(directory=None):
+    """Return the cache root, creating it if needed."""
+    if directory is None:
+        directory = os.environ.get(
+            "PHENOM_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "phenom")
+        )
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+@contextmanager
+def lock(path):
+    """Hold an exclusive advisory lock on path for the duration of the block."""
+    with open(path, "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def dump(obj, path):
+    """Pickle obj to path atomically, so readers never see a partial file."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            pickle.dump(obj, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def load(path):
+    """Unpickle path and mark it as recently used, or return None if missing."""
+    try:
+        with open(path, "rb") as fh:
+            obj = pickle.load(fh)
+        os.utime(path)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    return obj
+
+
+def toolchain():
+    """Versions that determine whether a compiled model can be reused."""
+    import pystan
+
+    return [
+        pystan.__version__,
+        sys.version,
+        platform.system(),
+        platform.machine(),
+        sysconfig.get_config_var("CC") or "",
+        os.environ.get("CC", ""),
+        os.environ.get("CXX", ""),
+        os.environ.get("CFLAGS", ""),
+    ]
+
+
+def key(code, extra_compile_args=()):
+    """Content hash of a Stan program, its compiler flags and the current toolchain."""
+    h = hashlib.sha256()
+    for s in [code] + list(extra_compile_args) + toolchain():
+        h.update(s.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def evict(directory, keep):
+    """Remove all but the keep most recently used entries in directory."""
+    with lock(os.path.join(directory, ".lock")):
+        entries = [
+            os.path.join(directory, f)
+            for f in os.listdir(directory)
+            if f.endswith(".pkl")
+        ]
+        entries.sort(key=os.path.getmtime, reverse=True)
+
+        for path in entries[keep:]:
+            for p in (path, path + ".lock"):
+                if os.path.exists(p):
+                    os.remove(p)
+
+
+def model(file, directory=None, max_models=MAX_MODELS, extra_compile_args=None):
+    """Load the compiled model for a Stan file, compiling it on a cache miss.
+
+    Concurrent callers asking for the same program wait on a per-model lock,
+    so it is compiled once no matter how many jobs start together. Programs
+    compiled with different extra_compile_args are cached separately.
+    """
+    import pystan
+
+    with open(file) as fh:
+        code = fh.read()
+
+    extra_compile_args = list(extra_compile_args or [])
+    k = key(code, extra_compile_args)
+    if k in _models:
+        return _models[k]
+
+    d = os.path.join(root(directory), "models")
+    os.makedirs(d, exist_ok=True)
+    path = os.path.join(d, k + ".pkl")
+
+    m = load(path)
+    if m is None:
+        with lock(path + ".lock"):
+            # another job may have finished compiling while we waited
+            m = load(path)
+            if m is None:
+                m = pystan.StanModel(file=file, extra_compile_args=extra_compile_args)
+                dump(m, path)
+        evict(d, max_models)
+
+    _models[k] = m
+    return m
+
+
+def _update(h, obj):
+    """Add a canonical encoding of nested dicts, sequences, arrays and scalars to h."""
+    if isinstance(obj, dict):
+        h.update(b"{")
+        for k in sorted(obj, key=str):
+            _update(h, str(k))
+            _update(h, obj[k])
+        h.update(b"}")
+    elif isinstance(obj, (list, tuple)):
+        h.update(b"[")
+        for v in obj:
+            _update(h, v)
+        h.update(b"]")
+    elif isinstance(obj, np.ndarray):
+        value = np.ascontiguousarray(obj)
+        h.update(("%s%s" % (value.dtype.str, value.shape)).encode("utf-8"))
+        h.update(value.tobytes())
+    elif isinstance(obj, np.generic):
+        _update(h, obj.item())
+    else:
+        h.update(("%s:%r" % (type(obj).__name__, obj)).encode("utf-8"))
+    h.update(b"\0")
+
+
+def posterior_key(cfg, code, *args, **kwargs):
+    """Hash of the data of a model, its Stan source and the arguments it is sampled with."""
+    h = hashlib.sha256()
+    for obj in [cfg, code, list(args), kwargs, toolchain()]:
+        _update(h, obj)
+    return h.hexdigest()
+
+
+def _size(d):
+    return sum(os.path.getsize(os.path.join(d, f)) for f in os.listdir(d))
+
+
+def posteriors(directory=None):
+    """Cached posteriors, most recently used first, with their size and fit information."""
+    d = os.path.join(root(directory), "posteriors")
+    if not os.path.isdir(d):
+        return []
+
+    entries = []
+    for k in os.listdir(d):
+        path = os.path.join(d, k)
+        if k.endswith(".tmp"):
+            # staged by store_posterior, not yet renamed into place
+            continue
+        if not os.path.exists(os.path.join(path, "fit.json")):
+            # incomplete, or being written
+            continue
+
+        with open(os.path.join(path, "fit.json")) as fh:
+            info = json.load(fh)
+
+        entries.append(
+            {
+                "key": k,
+                "path": path,
+                "bytes": _size(path),
+                "used": os.path.getmtime(path),
+                "created": info["created"],
+                "program": info["program"],
+                "method": info["method"],
+            }
+        )
+
+    entries.sort(key=lambda e: e["used"], reverse=True)
+    return entries
+
+
+def purge(keys=None, directory=None, max_bytes=None):
+    """Remove cached posteriors.
+
+    keys: remove these entries, all of them if None and max_bytes is None
+    max_bytes: otherwise, remove the least recently used entries until the
+        rest take at most max_bytes
+    """
+    d = os.path.join(root(directory), "posteriors")
+    os.makedirs(d, exist_ok=True)
+
+    removed = []
+    with lock(os.path.join(d, ".lock")):
+        entries = posteriors(directory)
+
+        if max_bytes is not None:
+            total = np.cumsum([e["bytes"] for e in entries])
+            remove = [e for e, t in zip(entries, total) if t > max_bytes]
+        elif keys is None:
+            remove = entries
+        else:
+            remove = [e for e in entries if e["key"] in keys]
+
+        for e in remove:
+            shutil.rmtree(e["path"], ignore_errors=True)
+            removed.append(e["key"])
+
+    return removed
+
+
+def load_posterior(k, directory=None):
+    """The cached fit with key k, as a phenom.fit.Fit, or None if it is not cached."""
+    from . import fit, posterior
+
+    path = os.path.join(root(directory), "posteriors", k)
+    try:
+        with open(os.path.join(path, "fit.json")) as fh:
+            info = json.load(fh)
+        samples = posterior.load(path)
+        adaptation = posterior.Posterior(path).index["adaptation"]
+        os.utime(path)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    for name in posterior.NATIVE:
+        samples.pop(name, None)
+
+    info["info"]["cached"] = k
+    info["info"].setdefault("adaptation", adaptation)
+    if info["summary"] is not None:
+        info["info"]["summary"] = info["summary"]
+
+    return fit.Fit(samples, info["method"], info["info"], info["chains"])
+
+
+def store_posterior(k, samp, program, directory=None, max_bytes=MAX_POSTERIOR_BYTES):
+    """Store a Stan fit or phenom.fit.Fit under key k, then evict down to max_bytes."""
+    from . import fit, posterior
+
+    d = os.path.join(root(directory), "posteriors")
+    os.makedirs(d, exist_ok=True)
+
+    if isinstance(samp, fit.Fit):
+        method, chains = samp.method, samp.chains
+        info = {
+            name: value
+            for name, value in samp.info.items()
+            if name not in ("summary", "cached")
+        }
+    else:
+        # the draws of a Stan fit are extracted permuted across chains
+        method, chains, info = "nuts", 1, {}
+
+    summary = samp.summary()
+    summary = {
+        "summary": np.asarray(summary["summary"]).tolist(),
+        "summary_rownames": list(summary["summary_rownames"]),
+        "summary_colnames": list(summary["summary_colnames"]),
+    }
+
+    tmp = tempfile.mkdtemp(dir=d, suffix=".tmp")
+    try:
+        posterior.save(samp.extract(), tmp, adaptation=fit.adaptation(samp))
+
+        with open(os.path.join(tmp, "fit.json"), "w") as fh:
+            json.dump(
+                {
+                    "created": time.time(),
+                    "program": program,
+                    "method": method,
+                    "chains": chains,
+                    "info": info,
+                    "summary": summary,
+                },
+                fh,
+                default=lambda o: np.asarray(o).tolist(),
+            )
+
+        with lock(os.path.join(d, ".lock")):
+            path = os.path.join(d, k)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.rename(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    purge(directory=directory, max_bytes=max_bytes)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["list", "purge"])
+    parser.add_argument("keys", nargs="*", help="entries to purge, all if none")
+    parser.add_argument("--max-bytes", type=int, default=None)
+
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for e in posteriors():
+            used = time.strftime("%Y-%m-%d %H:%M", time.localtime(e["used"]))
+            print(
+                "{}  {:>12d}  {}  {}  {}".format(
+                    e["key"], e["bytes"], used, e["program"], e["method"]
+                )
+            )
+    else:
+        removed = purge(args.keys or None, max_bytes=args.max_bytes)
+        print("removed {} posteriors".format(len(removed)))
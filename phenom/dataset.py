@@ -1,21 +1,133 @@
+import json
+import os
+import tempfile
+
 import pandas as pd
 import numpy as np
 
 nan_or_zero = lambda x: np.isnan(x) or abs(x) < 1e-9
 
+# directory, inside a data directory, holding its binary cache
+CACHE = '.phenom'
+
+def _fingerprint(path, digest=True):
+    """Size, modification time and (optionally) content hash of a file."""
+    import hashlib
+
+    stat = os.stat(path)
+    ret = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+    if digest:
+        h = hashlib.sha256()
+        with open(path, 'rb') as fh:
+            for block in iter(lambda: fh.read(1 << 20), b''):
+                h.update(block)
+        ret['sha256'] = h.hexdigest()
+
+    return ret
+
+def _fresh(record, path):
+    """Whether a file still matches its fingerprint, hashing only if its stat changed."""
+    if not os.path.exists(path):
+        return False
+
+    current = _fingerprint(path, digest=False)
+    if current['size'] == record['size'] and current['mtime'] == record['mtime']:
+        return True
+
+    return _fingerprint(path)['sha256'] == record['sha256']
+
+def _replace(path, write):
+    """Write a file through a uniquely named temporary file, then move it into place.
+
+    Concurrent writers never share a temporary file, so readers only ever see
+    one complete version of path.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            write(fh)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
 class DataSet(object):
 
     @classmethod
-    def fromDirectory(cls, dir, datafile = 'data.csv', metafile = 'meta.csv', *args, **kwargs):
-        import os
+    def fromDirectory(cls, dir, datafile = 'data.csv', metafile = 'meta.csv', *args, cache=True, **kwargs):
+        """Load data and meta csv files from dir.
+
+        With cache, the parsed dataset is also written to a binary sidecar in
+        dir (see toBinary) and later loads memory map it instead of parsing
+        the csv files again, until either file changes.
+        """
 
         assert datafile in os.listdir(dir)
         assert metafile in os.listdir(dir)
 
-        data = pd.read_csv(os.path.join(dir, datafile))
-        meta = pd.read_csv(os.path.join(dir, metafile))
+        sources = [os.path.join(dir, datafile), os.path.join(dir, metafile)]
+        arguments = repr((args, sorted(kwargs.items())))
+        cachedir = os.path.join(dir, CACHE)
+        record = os.path.join(cachedir, 'source.json')
+
+        if cache and os.path.exists(record):
+            with open(record) as fh:
+                rec = json.load(fh)
+
+            if rec['arguments'] == arguments and all(
+                    _fresh(r, p) for r, p in zip(rec['sources'], sources)):
+                try:
+                    return cls.fromBinary(cachedir)
+                except Exception:
+                    # unreadable sidecar, e.g. meta pickled by another pandas
+                    # version, parse the csv files again and rewrite it
+                    pass
+
+        data = pd.read_csv(sources[0])
+        meta = pd.read_csv(sources[1])
 
-        return cls(data, meta, *args, **kwargs)
+        ds = cls(data, meta, *args, **kwargs)
+
+        if cache and all(np.issubdtype(t, np.number) for t in ds.data.dtypes):
+            try:
+                ds.toBinary(cachedir)
+
+                # written last, so an interrupted write is never trusted
+                rec = {'arguments': arguments,
+                       'sources': [_fingerprint(p) for p in sources]}
+                _replace(record, lambda fh: fh.write(json.dumps(rec).encode('utf-8')))
+            except OSError:
+                # read-only data directories are loaded without a cache
+                pass
+
+        return ds
+
+    @classmethod
+    def fromBinary(cls, dir, mmap_mode='c'):
+        """Load a dataset written by toBinary.
+
+        The data are memory mapped, copy-on-write by default so the dataset
+        can be modified without touching the files.
+        """
+
+        time = np.load(os.path.join(dir, 'time.npy'))
+        data = np.load(os.path.join(dir, 'data.npy'), mmap_mode=mmap_mode)
+        meta = pd.read_pickle(os.path.join(dir, 'meta.pkl'))
+
+        return cls(pd.DataFrame(data, index=time, copy=False), meta)
+
+    def toBinary(self, dir):
+        """Save as a time index, a (time x curve) float array and a typed meta table."""
+
+        os.makedirs(dir, exist_ok=True)
+
+        for name, value in [('time.npy', self.data.index.values),
+                            ('data.npy', np.ascontiguousarray(self.data.values, dtype=float))]:
+            _replace(os.path.join(dir, name), lambda fh: np.save(fh, value))
+
+        _replace(os.path.join(dir, 'meta.pkl'), self.meta.to_pickle)
 
     def __init__(self,data, meta=None, timeColumn = 0):
 
@@ -42,11 +154,71 @@ class DataSet(object):
         self.data.index.name='time'
 
     def concat(self, other):
-        data = pd.merge(
-                    self.data, other.data, left_index=True, right_index=True, how='outer')
-        meta = pd.concat((self.meta, other.meta), 0)
+        return self.concat_many([self, other])
 
-        return DataSet(data, meta)
+    @classmethod
+    def concat_many(cls, datasets, tol=None):
+        """Concatenate the curves of several datasets.
+
+        The result is defined on the sorted union of all time points, missing
+        observations are nan. With tol, each group of time points starts at
+        the first point more than tol after the start of the previous group,
+        and takes all points up to tol after it, so slightly offset readings
+        of different plates line up. Readings of a curve merged into the
+        same point are averaged.
+        """
+
+        times = [np.asarray(ds.data.index) for ds in datasets]
+
+        grid = np.unique(np.concatenate(times))
+        if tol is not None and grid.shape[0] > 0:
+            # each grid point starts a group absorbing the points up to tol after it
+            keep = [0]
+            for i in range(1, grid.shape[0]):
+                if grid[i] - grid[keep[-1]] > tol:
+                    keep.append(i)
+            grid = grid[keep]
+
+        data = np.full((grid.shape[0], sum(ds.data.shape[1] for ds in datasets)), np.nan)
+
+        col = 0
+        for ds, t in zip(datasets, times):
+            # position of the (first) grid point each time point was merged into
+            rows = np.searchsorted(grid, t, side='right') - 1
+            values = ds.data.values
+
+            if np.unique(rows).shape[0] < rows.shape[0]:
+                # several readings in one group, average the observed ones
+                observed = ~np.isnan(values)
+                total = np.zeros((grid.shape[0], values.shape[1]))
+                count = np.zeros((grid.shape[0], values.shape[1]))
+                np.add.at(total, rows, np.where(observed, values, 0))
+                np.add.at(count, rows, observed)
+
+                with np.errstate(invalid='ignore'):
+                    values = (total / count)[np.unique(rows)]
+                rows = np.unique(rows)
+
+            data[rows, col:col + ds.data.shape[1]] = values
+            col += ds.data.shape[1]
+
+        meta = pd.concat([ds.meta for ds in datasets], axis=0)
+
+        return cls(pd.DataFrame(data, index=grid), meta)
+
+    @classmethod
+    def fromDirectories(cls, dirs, tol=None, workers=1, **kwargs):
+        """Load and concatenate the datasets in dirs, using workers threads to load them."""
+
+        if workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                datasets = list(pool.map(lambda d: cls.fromDirectory(d, **kwargs), dirs))
+        else:
+            datasets = [cls.fromDirectory(d, **kwargs) for d in dirs]
+
+        return cls.concat_many(datasets, tol)
 
     def floor(self, tol=1e-9):
         self.data.values[self.data<=tol] = tol
@@ -90,12 +262,12 @@ class DataSet(object):
 
     def melt(self, norm=False, convertNames=False):
 
-        pivot = pd.concat((self.meta, self.data.T),1,ignore_index=False)
+        # long form, time major: every curve at the first time point, then the second...
+        ntime, ncurve = self.data.shape
 
-        idvars = pivot.columns[:self.meta.shape[1]].tolist()
-        valuevars = pivot.columns[self.meta.shape[1]:].tolist()
-        melt = pd.melt(pivot, idvars, valuevars, var_name='time', value_name='od')
-        melt.time = melt.time.astype(float)
+        melt = self.meta.iloc[np.tile(np.arange(ncurve), ntime)].reset_index(drop=True)
+        melt['time'] = np.repeat(self.data.index.values.astype(float), ncurve)
+        melt['od'] = self.data.values.ravel()
 
         if norm:
             melt.od = (melt.od-melt.od.mean())/melt.od.std()
@@ -114,40 +286,60 @@ class DataSet(object):
 
     def build(self,effects=[],covariates=[],scale=None,**kwargs):
 
-        if 'x' in covariates:
-            covariates.remove('x')
+        covariates = [c for c in covariates if c != 'x']
 
         if len(covariates)>0:
-            temp = pd.concat((self.meta,self.data.T),1)
-            temp['rep'] = temp.index
+            # one row per (time, covariate values) pair, sorted by both, with
+            # each curve observed only in the rows of its own covariate values
+            codes = self.meta.groupby(covariates).ngroup().fillna(-1).astype(int).values
+            found, first = np.unique(codes, return_index=True)
+            first = first[found >= 0]
+            ngroup = first.shape[0]
+
+            time, tind = np.unique(self.data.index.values, return_inverse=True)
+            curves, = np.where(codes >= 0)
+
+            rows = tind[:, None] * ngroup + codes[None, curves]
+            values = self.data.values[:, curves]
+
+            y = np.full((time.shape[0] * ngroup, self.data.shape[1]), np.nan)
+            if time.shape[0] == tind.shape[0]:
+                y[rows, curves[None, :]] = values
+            else:
+                # repeated time points, average their observations as
+                # pivot_table did
+                observed = ~np.isnan(values)
+                total = np.zeros(y.shape)
+                count = np.zeros(y.shape)
+                np.add.at(total, (rows, curves[None, :]), np.where(observed, values, 0))
+                np.add.at(count, (rows, curves[None, :]), observed)
 
-            tidy = pd.melt(temp,self.meta.columns.tolist()+['rep'],
-                            self.data.index.tolist(),
-                            var_name='x',value_name='y')
+                with np.errstate(invalid='ignore'):
+                    y = total / count
 
-            pivot = pd.pivot_table(tidy,values='y',
-                            index=['x']+covariates,
-                            columns=['rep'])
+            x = np.empty((y.shape[0], len(covariates) + 1), dtype=object)
+            x[:, 0] = np.repeat(time, ngroup)
+            x[:, 1:] = np.tile(self.meta[covariates].values[first], (time.shape[0], 1))
 
-            x = pd.DataFrame(np.array(pivot.index.tolist()),columns=['x']+covariates).values
-            y = pivot.values
+            keep = ~np.isnan(y).all(1)
+            x = pd.DataFrame(np.array(x[keep].tolist()), columns=['x']+covariates).values
+            y = y[keep]
 
         else:
-            x = pd.DataFrame(self.data.index.values,columns=['x']).values
+            x = self.data.index.values[:, None]
             y = self.data.values
 
-        effect = self.meta[effects]
         labels = []
 
-        select = [True]*self.meta.shape[0]
+        select = np.ones(self.meta.shape[0], dtype=bool)
         for k in kwargs.keys():
             if k in self.meta:
                 if type(kwargs[k]) == list:
-                    select = (select) & (self.meta[k].apply(lambda x: x in kwargs[k]))
+                    select &= self.meta[k].isin(kwargs[k]).values
                 else:
-                    select = (select) & (self.meta[k] == kwargs[k])
+                    select &= (self.meta[k] == kwargs[k]).values
         y = y[:,np.where(select)[0]]
-        effect = effect.loc[select,:]
+        effect = self.meta.loc[select,effects].copy()
 
         for e in effect.columns:
             temp,l = pd.factorize(effect[e])
@@ -165,27 +357,35 @@ class DataSet(object):
         """Scale growth data by a polynomial of degree p, using the first ind datapoints, grouping by groupby."""
 
         time = self.data.index.values[:ind]
+        od = self.data.values[:ind, :].astype(float)
 
         if groupby is None:
-            #group = {(None,self.meta.index)}
-            for i in range(self.data.shape[1]):
-                temp = self.data.iloc[:,i]
-                od = temp.values[:ind]
+            codes = np.arange(self.data.shape[1])
+        else:
+            # a group's fit to all its curves is the fit to their mean curve
+            # curves with a missing group value are numbered -1
+            codes = self.meta.groupby(groupby).ngroup().fillna(-1).astype(int).values
+            groups = codes.max() + 1
 
-                coeff = np.polyfit(time,od,p)
+            if groups == 0:
+                return
 
-                temp = temp - np.polyval(coeff,self.data.index.values[0])
-                self.data.iloc[:,i] = temp
-        else:
-            group = self.meta.groupby(groupby)
-            for k,index in group.groups.items():
-                temp = self.data.loc[:,index]
-                od = temp.values[:ind,:].ravel()
+            member = (codes[:, None] == np.arange(groups)[None, :]).astype(float)
+            od = od @ member / member.sum(0)
+
+        # all fits as one least squares problem, with the columns of the
+        # vandermonde matrix scaled as np.polyfit does
+        vander = np.vander(time, p + 1)
+        scale = np.sqrt((vander * vander).sum(0))
+        coeff, _, _, _ = np.linalg.lstsq(vander / scale, od, rcond=len(time) * np.finfo(float).eps)
+        coeff = coeff / scale[:, None]
+
+        offset = (np.vander(self.data.index.values[:1], p + 1) @ coeff)[0]
 
-                coeff = np.polyfit(time.tolist()*temp.shape[1],od,p)
+        # curves outside of any group (missing group values) are not scaled
+        offset = np.where(codes >= 0, offset[codes], 0)
 
-                temp = temp - np.polyval(coeff,self.data.index.values[0])
-                self.data.loc[:,index] = temp
+        self.data = self.data.sub(pd.Series(offset, index=self.data.columns), axis=1)
 
     def filter(self):
         """Remove data rows where observations are missing (in any column!)"""
@@ -0,0 +1,101 @@
+"""Posterior draws of latent function derivatives.
+
+Under a squared exponential kernel the derivative of a gaussian process is
+jointly gaussian with the process itself, so given draws of ``f`` and of the
+kernel hyperparameters, ``df/dx`` can be drawn from its conditional
+distribution. This is the computation done in the generated quantities of
+``phenom_deriv.stan``, batched over draws and functions in NumPy so it can be
+run after sampling, and only for the functions of interest.
+"""
+import numpy as np
+
+
+def _sqrt(cov):
+    """Batched lower cholesky factor, falling back to a clipped eigen decomposition."""
+    try:
+        return np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        w, v = np.linalg.eigh(cov)
+        return v * np.sqrt(np.clip(w, 0, None))[..., None, :]
+
+
+def sample(
+    x,
+    f,
+    alpha,
+    lengthscale,
+    priors,
+    functions=None,
+    nugget=1e-8,
+    batch=500,
+    random_state=None,
+):
+    """Draw df/dx for each posterior draw of f.
+
+    x: time points (N,), on the scale the model was fit on
+    f: function draws (S, K, N)
+    alpha, lengthscale: kernel hyperparameter draws (S, L)
+    priors: prior index of each function (K,), starting at zero
+    functions: indices of the functions to differentiate, defaults to all
+
+    Returns an array of shape (S, len(functions), N).
+    """
+    import scipy.linalg
+
+    x = np.asarray(x, dtype=float)
+    f = np.asarray(f)
+    alpha = np.asarray(alpha).reshape(f.shape[0], -1)
+    lengthscale = np.asarray(lengthscale).reshape(f.shape[0], -1)
+    priors = np.asarray(priors).astype(int)
+
+    if functions is None:
+        functions = np.arange(f.shape[1])
+    functions = np.asarray(functions).astype(int)
+
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+
+    S, N = f.shape[0], x.shape[0]
+    diff = x[:, None] - x[None, :]
+    dist2 = diff ** 2
+    eye = nugget * np.eye(N)
+
+    df = np.zeros((S, functions.shape[0], N))
+
+    for l in np.unique(priors[functions]):
+        (sel,) = np.where(priors[functions] == l)
+
+        for start in range(0, S, batch):
+            s = slice(start, min(start + batch, S))
+
+            lsInv = (1.0 / lengthscale[s, l] ** 2)[:, None, None]
+
+            # cov(f), cov(df, f) and cov(df, df)
+            K = alpha[s, l, None, None] ** 2 * np.exp(-0.5 * lsInv * dist2)
+            dK = -lsInv * K * diff
+            ddK = lsInv * (K - lsInv * K * dist2)
+
+            # one factorization per prior per draw, shared by all its functions,
+            # and one triangular solve of it for cov(df, f) and f together
+            L = np.linalg.cholesky(K + eye)
+            rhs = np.concatenate(
+                (np.swapaxes(dK, 1, 2), np.swapaxes(f[s][:, functions[sel], :], 1, 2)),
+                axis=2,
+            )
+            solved = np.stack(
+                [
+                    scipy.linalg.solve_triangular(
+                        Li, bi, lower=True, check_finite=False
+                    )
+                    for Li, bi in zip(L, rhs)
+                ]
+            )
+            v, a = solved[:, :, :N], solved[:, :, N:]
+
+            mu = np.swapaxes(v, 1, 2) @ a
+            cov = ddK - np.swapaxes(v, 1, 2) @ v
+
+            z = random_state.standard_normal(mu.shape)
+            df[s, sel, :] = np.swapaxes(mu + _sqrt(cov + eye) @ z, 1, 2)
+
+    return df
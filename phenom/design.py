@@ -1,4 +1,3 @@
-import patsy
 import re
 import attr
 
@@ -6,8 +5,28 @@ import numpy as np
 import pandas as pd
 from copy import copy
 from abc import ABCMeta, abstractmethod
+from functools import wraps
 from itertools import product
 
+
+def cached(f):
+    """Property computed once per design node.
+
+    Designs are immutable once built, so the matrix, priors and names of each
+    node (and therefore of every expression containing it) are only computed
+    on first access.
+    """
+
+    @wraps(f)
+    def wrapper(self):
+        cache = self.__dict__.setdefault('_cache', {})
+        if f.__name__ not in cache:
+            cache[f.__name__] = f(self)
+        return cache[f.__name__]
+
+    return property(wrapper)
+
+
 @attr.s
 class Design(metaclass=ABCMeta):
 
@@ -15,7 +34,7 @@ class Design(metaclass=ABCMeta):
 
     @property
     def k(self):
-        return self.matrix.shape[1]
+        return len(self.names)
 
     @property
     def n(self):
@@ -25,7 +44,7 @@ class Design(metaclass=ABCMeta):
     def L(self):
         return max(self.priors) + 1
 
-    @property
+    @cached
     def names(self):
         return self._names()
 
@@ -33,7 +52,7 @@ class Design(metaclass=ABCMeta):
     def _names(self):
         pass
 
-    @property
+    @cached
     def matrix(self):
         return self._matrix()
 
@@ -41,11 +60,21 @@ class Design(metaclass=ABCMeta):
     def _matrix(self):
         pass
 
-    @property
+    @cached
+    def sparse(self):
+        """The design matrix in scipy.sparse CSR format."""
+        return self._sparse()
+
+    def _sparse(self):
+        import scipy.sparse
+
+        return scipy.sparse.csr_matrix(self.matrix)
+
+    @cached
     def frame(self):
         return pd.DataFrame(self.matrix, columns=self.names)
 
-    @property
+    @cached
     def priors(self):
         return np.array(self._priors()).astype(int)
 
@@ -75,6 +104,11 @@ class Add(Design):
     def _matrix(self):
         return np.concatenate((self.d1.matrix, self.d2.matrix), 1)
 
+    def _sparse(self):
+        import scipy.sparse
+
+        return scipy.sparse.hstack((self.d1.sparse, self.d2.sparse), format='csr')
+
     def _priors(self):
 
         p1 = self.d1.priors
@@ -91,25 +125,29 @@ class Kron(Design):
 
     def _matrix(self):
 
-        ret = []
+        # row-wise kronecker (khatri-rao) product of the two designs
         m1, m2 = self.d1.matrix, self.d2.matrix
 
-        for i in range(self.n):
-            ret.append(np.kron(m1[i,:], m2[i,:]))
+        return (m1[:, :, None] * m2[:, None, :]).reshape(self.n, -1)
+
+    def _sparse(self):
+        import scipy.sparse
+
+        # repeat each column of d1 once per column of d2, tile the columns
+        # of d2 once per column of d1, and multiply elementwise
+        m1, m2 = self.d1.sparse, self.d2.sparse
 
-        return np.array(ret)
+        r1 = scipy.sparse.kron(m1, np.ones((1, m2.shape[1])), format='csr')
+        r2 = scipy.sparse.kron(np.ones((1, m1.shape[1])), m2, format='csr')
+
+        return r1.multiply(r2).tocsr()
 
     def _priors(self):
 
         p1 = self.d1.priors
         p2 = self.d2.priors
 
-        priors = []
-
-        for v1, v2 in product(p1, p2):
-            priors.append(v1 + v2 * (max(p1) + 1))
-
-        return priors
+        return (p1[:, None] + p2[None, :] * (p1.max() + 1)).ravel()
 
     def _names(self):
 
@@ -123,6 +161,8 @@ class Formula(Design):
     form = attr.ib()
 
     def __attrs_post_init__(self):
+        import patsy
+
         self.d = patsy.dmatrix(self.form, self.meta)
 
     def _matrix(self):
@@ -0,0 +1,109 @@
+"""Convergence diagnostics of MCMC draws.
+
+Split R-hat and effective sample size as reported by Stan 2, computed from
+draws arranged (iterations, chains, ...) and vectorized over the trailing
+dimensions, so every element of f is checked at once. ``Target`` describes
+when an incrementally sampled posterior has converged, see
+``Phenotype.samples``.
+"""
+import attr
+import numpy as np
+
+
+def split(draws):
+    """Split each chain in half, giving (iterations // 2, 2 * chains, ...) draws."""
+    draws = np.asarray(draws, dtype=float)
+    n = draws.shape[0] // 2
+    return np.concatenate((draws[:n], draws[draws.shape[0] - n :]), axis=1)
+
+
+def _variances(draws):
+    n = draws.shape[0]
+
+    within = draws.var(axis=0, ddof=1).mean(axis=0)
+    between = n * draws.mean(axis=0).var(axis=0, ddof=1)
+
+    return within, (n - 1) / n * within + between / n
+
+
+def rhat(draws):
+    """Potential scale reduction of (iterations, chains, ...) draws, on split chains."""
+    draws = split(draws)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        within, total = _variances(draws)
+        return np.sqrt(total / within)
+
+
+def _autocovariance(draws):
+    """Autocovariance of each chain along axis 0, via the FFT."""
+    n = draws.shape[0]
+    centered = draws - draws.mean(axis=0)
+
+    size = 2 ** int(np.ceil(np.log2(2 * n)))
+    spectrum = np.fft.rfft(centered, n=size, axis=0)
+
+    return np.fft.irfft(spectrum * np.conjugate(spectrum), n=size, axis=0)[:n] / n
+
+
+def ess(draws):
+    """Effective sample size of (iterations, chains, ...) draws, on split chains.
+
+    The autocorrelations of all chains are combined and summed over Geyer's
+    initial monotone sequence, as in Stan.
+    """
+    draws = split(draws)
+    n, m = draws.shape[:2]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        within, total = _variances(draws)
+
+        rho = 1 - (within - _autocovariance(draws).mean(axis=1)) / total
+        rho[0] = 1
+
+        # sums of adjacent pairs, kept while positive and made non-increasing
+        pairs = rho[: 2 * (n // 2)].reshape((n // 2, 2) + rho.shape[1:]).sum(axis=1)
+        positive = np.cumprod(pairs > 0, axis=0).astype(bool)
+        pairs = np.minimum.accumulate(np.where(positive, pairs, 0), axis=0)
+
+        tau = -1 + 2 * pairs.sum(axis=0)
+        return n * m / np.maximum(tau, 1 / np.log10(n * m))
+
+
+@attr.s
+class Target(object):
+    """When to stop sampling more draws.
+
+    Sampling stops once every element of pars (and of the functions of f
+    listed in functions) has split R-hat below rhat and an effective sample
+    size of at least ess, or after max_increments increments of increment
+    iterations per chain.
+    """
+
+    rhat = attr.ib(default=1.01)
+    ess = attr.ib(default=400)
+    increment = attr.ib(default=500)
+    max_increments = attr.ib(default=10)
+    pars = attr.ib(default=("lengthscale", "alpha", "sigma"))
+    functions = attr.ib(default=None)
+
+    def check(self, draws):
+        """Worst R-hat and ESS of the draws of each checked parameter, and whether all are met.
+
+        draws: arrays (iterations, chains, ...) by parameter name
+        """
+        checked = {p: draws[p] for p in self.pars if p in draws}
+        if self.functions is not None and "f" in draws:
+            checked["f"] = draws["f"][:, :, list(self.functions)]
+
+        result = {}
+        for name, value in checked.items():
+            result["rhat_" + name] = float(np.nanmax(rhat(value)))
+            result["ess_" + name] = float(np.nanmin(ess(value)))
+
+        result["converged"] = all(
+            result["rhat_" + name] <= self.rhat and result["ess_" + name] >= self.ess
+            for name in checked
+        )
+
+        return result
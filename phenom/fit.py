@@ -0,0 +1,166 @@
+"""Results of approximate inference in the form of a Stan fit.
+
+Phenotype.optimize and Phenotype.variational return a Fit, which provides the
+extract and summary methods of pystan's StanFit4Model used by Phenotype.save,
+so their results are stored and compared like sampled posteriors. A MAP
+estimate is a posterior with a single draw. Draws sampled in increments by
+Phenotype.samples are combined into a Fit of several chains.
+"""
+import re
+
+import numpy as np
+
+from . import diagnostics
+
+FLATNAME = re.compile(r"^(?P<name>[^\[.]+)(?:[\[.](?P<index>[0-9,.]+)\]?)?$")
+
+
+def unflatten(names, values):
+    """Arrays of draws by parameter from flat names ('f[1,2]' or 'f.1.2') and their draws.
+
+    Stan indices start at one. The arrays are indexed (draw, *dims), or
+    (iteration, chain, *dims) for draws by chain.
+    """
+
+    columns = {}
+    for n, v in zip(names, values):
+        match = FLATNAME.match(n)
+        if match is None:
+            continue
+
+        index = match.group("index")
+        index = (
+            () if index is None else tuple(int(i) - 1 for i in re.split("[,.]", index))
+        )
+        columns.setdefault(match.group("name"), []).append(
+            (index, np.asarray(v, dtype=float))
+        )
+
+    samples = {}
+    for name, entries in columns.items():
+        draws = entries[0][1].shape
+        shape = (
+            tuple(np.max([i for i, _ in entries], axis=0) + 1) if entries[0][0] else ()
+        )
+
+        value = np.empty(draws + shape)
+        for index, v in entries:
+            value[(Ellipsis,) + index] = v
+        samples[name] = value
+
+    return samples
+
+
+def chains(f):
+    """Draws of a Stan fit by parameter, kept apart by chain as (iteration, chain, *dims)."""
+    draws = f.extract(permuted=False)
+    names = f.sim["fnames_oi"]
+
+    return unflatten(names, [draws[:, :, i] for i in range(len(names))])
+
+
+def adaptation(f):
+    """Step size and inverse metric NUTS adapted to in each chain of a fit, or None."""
+    if isinstance(f, Fit):
+        return f.info.get("adaptation")
+
+    try:
+        return {
+            "stepsize": [float(s) for s in f.get_stepsize()],
+            "inv_metric": [np.asarray(m).tolist() for m in f.get_inv_metric()],
+        }
+    except (AttributeError, ValueError, RuntimeError):
+        # not a NUTS fit, or one without adaptation
+        return None
+
+
+class Fit(object):
+    """Draws of every model parameter, with the interface of a Stan fit."""
+
+    def __init__(self, samples, method, info=None, chains=1):
+        self.samples = samples
+        self.method = method
+
+        # MCMC draws are ordered by chain, in chains blocks of equal length
+        self.chains = chains
+
+        # anything else reported by the algorithm, e.g. its arguments
+        self.info = {} if info is None else info
+
+    @classmethod
+    def fromChains(cls, draws, method, info=None):
+        """Fit of draws by parameter, each indexed (iteration, chain, *dims)."""
+        samples = {
+            k: np.swapaxes(v, 0, 1).reshape((-1,) + v.shape[2:])
+            for k, v in draws.items()
+        }
+        chains = next(iter(draws.values())).shape[1]
+
+        return cls(samples, method, info, chains)
+
+    @property
+    def draws(self):
+        return next(iter(self.samples.values())).shape[0]
+
+    def extract(self, pars=None):
+        if pars is None:
+            pars = list(self.samples)
+        elif isinstance(pars, str):
+            pars = [pars]
+
+        return {p: self.samples[p].copy() for p in pars}
+
+    def summary(self, probs=(0.025, 0.25, 0.5, 0.75, 0.975)):
+        """Posterior mean, sd and quantiles of every parameter, as StanFit4Model.summary.
+
+        n_eff and Rhat are those of phenom.diagnostics for fits of several
+        chains. Approximate draws are independent, so for them se_mean, n_eff
+        and Rhat are nan. Fits loaded from phenom.cache return the summary
+        of the fit that was stored.
+        """
+        if "summary" in self.info:
+            return self.info["summary"]
+
+        colnames = ["mean", "se_mean", "sd"]
+        colnames += ["%g%%" % (100 * p) for p in probs]
+        colnames += ["n_eff", "Rhat"]
+
+        rownames, rows = [], []
+        for name, value in self.samples.items():
+            flat = value.reshape(value.shape[0], -1)
+            missing = np.full(flat.shape[1], np.nan)
+
+            for index in np.ndindex(*value.shape[1:]):
+                if index == ():
+                    rownames.append(name)
+                else:
+                    rownames.append(
+                        "%s[%s]" % (name, ",".join(str(i + 1) for i in index))
+                    )
+
+            if self.chains > 1:
+                by_chain = flat.reshape(self.chains, -1, flat.shape[1]).swapaxes(0, 1)
+                n_eff = diagnostics.ess(by_chain)
+                rhat = diagnostics.rhat(by_chain)
+                se_mean = flat.std(0) / np.sqrt(n_eff)
+            else:
+                n_eff = rhat = se_mean = missing
+
+            stats = [flat.mean(0), se_mean, flat.std(0)]
+            stats += list(np.quantile(flat, probs, axis=0))
+            stats += [n_eff, rhat]
+
+            rows.append(np.array(stats).T)
+
+        return {
+            "summary": np.concatenate(rows) if rows else np.empty((0, len(colnames))),
+            "summary_rownames": np.array(rownames),
+            "summary_colnames": colnames,
+        }
+
+    def __repr__(self):
+        return "Fit(%s, %d draws of %s)" % (
+            self.method,
+            self.draws,
+            ", ".join(self.samples),
+        )
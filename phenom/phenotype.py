@@ -1,8 +1,24 @@
+import json
 import numpy as np
-import pystan
 import os
 import pickle
 import pandas as pd
+import time
+import warnings
+from contextlib import contextmanager
+
+from . import approx, cache, derivative, fit, posterior
+
+# warmup iterations when reusing the adaptation of an earlier fit
+WARM_WARMUP = 250
+
+# programs splitting the likelihood over threads with map_rect, and the flags
+# they are compiled with
+THREADED = {
+    "phenom.stan": "phenom_threaded.stan",
+    "phenom_marginal.stan": "phenom_marginal_threaded.stan",
+}
+THREAD_FLAGS = ["-DSTAN_THREADS", "-pthread"]
 
 
 class Phenotype(object):
@@ -19,6 +35,9 @@ class Phenotype(object):
         maxExpectedCross=100,
         minExpectedCross=0.01,
         reduce=False,
+        basis_functions=60,
+        boundary_factor=3.0,
+        threads=None,
     ):
 
         self.data = data
@@ -42,26 +61,78 @@ class Phenotype(object):
 
         self.reduce = reduce
 
+        # basis approximation of phenom_hsgp.stan, the lengthscales it
+        # resolves shrink as basis_functions / boundary_factor grows
+        self.basis_functions = basis_functions
+        self.boundary_factor = boundary_factor
+
+        # threads evaluating the likelihood of each chain, replicates are
+        # split between them by the threaded variant of the model
+        self.threads = threads
+
         self.posteriors = []
         self._model = None
         self._modelFile = model
 
+        if threads is not None and self.program not in THREADED.values():
+            raise ValueError("%s has no threaded variant" % model)
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self._normalized = None
+
+    @property
+    def design(self):
+        return self._design
+
+    @design.setter
+    def design(self, value):
+        self._design = value
+        self._normalized = None
+
+    @property
+    def reduce(self):
+        return self._reduce
+
+    @reduce.setter
+    def reduce(self, value):
+        self._reduce = value
+        self._normalized = None
+
+    @property
+    def program(self):
+        """The Stan program sampled, the threaded variant of the model if threads is set."""
+        if self.threads is not None:
+            return THREADED.get(self._modelFile, self._modelFile)
+        return self._modelFile
+
     @property
     def model(self):
         d, _ = os.path.split(__file__)
 
         if self._model is None:
-            self._model = pystan.StanModel(
-                file=os.path.join(d, "stan", self._modelFile)
+            self._model = cache.model(
+                os.path.join(d, "stan", self.program),
+                extra_compile_args=(
+                    THREAD_FLAGS if self.program in THREADED.values() else None
+                ),
             )
         return self._model
 
     def config(self):
 
         x, y, _, _ = self.normalize()
-        dm = self.design.matrix
         if self.reduce:
             dm = np.unique(self.design.matrix, axis=0)
+        elif self._modelFile == "phenom_sparse.stan":
+            dm = self.design.sparse
+        else:
+            dm = self.design.matrix
 
         priors = self.design.priors + 1
         k = self.design.k
@@ -90,37 +161,194 @@ class Phenotype(object):
         # self.marginalEffect_lengthscale_alpha,
         # self.marginalEffect_lengthscale_beta]
 
-        # expected number of origin crossings = 1/(pi * lengthscale)
-        cfg["ls_min"] = 1.0 / np.pi / self.maxExpectedCross
-        cfg["ls_max"] = 1.0 / np.pi / self.minExpectedCross
+        cfg["ls_min"], cfg["ls_max"] = self.lengthscaleRange()
+
+        if self._modelFile == "phenom_sufficient.stan":
+            cfg.update(self.sufficient(y, dm))
+        elif self._modelFile == "phenom_sparse.stan":
+            cfg.update(self.csr(cfg.pop("design")))
+        elif self._modelFile == "phenom_hsgp.stan":
+            cfg["M"] = self.basis_functions
+            cfg["c"] = self.boundary_factor
+
+        if self.program in THREADED.values():
+            cfg["shards"] = min(self.threads or 1, cfg["P"])
 
         return cfg
 
+    @contextmanager
+    def threading(self):
+        """Set STAN_NUM_THREADS for the threaded programs while Stan runs, then restore it.
+
+        Stan reads the variable whenever map_rect runs, in every chain's process.
+        """
+        if self.program not in THREADED.values():
+            yield
+            return
+
+        previous = os.environ.get("STAN_NUM_THREADS")
+        os.environ["STAN_NUM_THREADS"] = str(self.threads or 1)
+        try:
+            yield
+        finally:
+            if previous is None:
+                del os.environ["STAN_NUM_THREADS"]
+            else:
+                os.environ["STAN_NUM_THREADS"] = previous
+
+    def lengthscaleRange(self):
+        """Bounds of the lengthscales, on time scaled to [0, 1]."""
+
+        # expected number of origin crossings = 1/(pi * lengthscale)
+        ls_min = 1.0 / np.pi / self.maxExpectedCross
+        ls_max = 1.0 / np.pi / self.minExpectedCross
+
+        if self._modelFile == "phenom_hsgp.stan":
+            ls_min, ls_max = self._hsgpBounds(ls_min, ls_max)
+
+        return ls_min, ls_max
+
+    def hsgpRange(self):
+        """Lengthscales (on time scaled to [0, 1]) phenom_hsgp.stan approximates well.
+
+        Shorter lengthscales need more basis functions, longer ones a larger
+        boundary factor: the kernel error stays below about 1e-3 within
+        0.9 c / M and c / 6.4.
+        """
+        return (
+            0.9 * self.boundary_factor / self.basis_functions,
+            self.boundary_factor / 6.4,
+        )
+
+    def _hsgpBounds(self, ls_min, ls_max):
+        """Lengthscale bounds of phenom_hsgp.stan, with ls_max capped to hsgpRange."""
+        low, high = self.hsgpRange()
+
+        if ls_min > high:
+            raise ValueError(
+                "no lengthscale between %.3g and %.3g is approximated well, "
+                "increase boundary_factor to at least %.3g"
+                % (ls_min, high, 6.4 * ls_min)
+            )
+        if ls_min < low:
+            warnings.warn(
+                "lengthscales below %.3g are approximated poorly, "
+                "increase basis_functions to %d"
+                % (low, np.ceil(0.9 * self.boundary_factor / ls_min))
+            )
+        if ls_max > high:
+            warnings.warn(
+                "lengthscales above %.3g are approximated poorly and excluded, "
+                "increase boundary_factor to %.3g to allow up to %.3g"
+                % (high, 6.4 * ls_max, ls_max)
+            )
+            ls_max = high
+
+        return ls_min, ls_max
+
+    def csr(self, dm):
+        """Compressed sparse row fields of the design, indexed from one as in Stan."""
+        import scipy.sparse
+
+        dm = scipy.sparse.csr_matrix(dm)
+
+        return {
+            "nnz": dm.nnz,
+            "design_w": dm.data,
+            "design_v": dm.indices + 1,
+            "design_u": dm.indptr + 1,
+        }
+
+    def sufficient(self, y, dm):
+        """Sufficient statistics of replicates grouped by unique design row.
+
+        The gaussian likelihood of every replicate sharing a design row only
+        depends on the number of replicates, their sum and their sum of
+        squares, so the likelihood cost scales with the number of unique
+        conditions rather than the number of replicates.
+        """
+
+        groups, ind = np.unique(dm, axis=0, return_inverse=True)
+        ind = ind.ravel()
+        G = groups.shape[0]
+
+        ysum = np.zeros((G, y.shape[0]))
+        np.add.at(ysum, ind, y.T)
+
+        return {
+            "G": G,
+            "group_design": groups,
+            "count": np.bincount(ind, minlength=G),
+            "ysum": ysum,
+            "ysq": np.bincount(ind, weights=(y ** 2).sum(0), minlength=G),
+        }
+
     def normalize(self):
+        """Time scaled to [0, 1] and standardized observations, with their constants.
 
-        x = self.data.index.values
+        Computed once and reused until data, design or reduce are assigned again;
+        changes made to the data frame in place need an explicit
+        invalidate().
+        """
 
-        xnorm = (x.min(), x.max())
-        x = (x - x.min()) / (x.max() - x.min())
+        if self._normalized is None:
+            x = self.data.index.values
 
-        y = self.data.values
+            xnorm = (x.min(), x.max())
+            x = (x - x.min()) / (x.max() - x.min())
 
-        if self.reduce:
-            uniq, ind = np.unique(self.design.matrix, axis=0, return_inverse=True)
+            y = self.data.values
+
+            if self.reduce:
+                # mean of the replicates of each unique design row
+                _, ind = np.unique(self.design.matrix, axis=0, return_inverse=True)
+                ind = ind.ravel()
+
+                ysum = np.zeros((ind.max() + 1, x.shape[0]))
+                np.add.at(ysum, ind, y.T)
+                y = (ysum / np.bincount(ind)[:, None]).T
 
-            tmp = np.zeros((x.shape[0], uniq.shape[0]))
+            ynorm = (y.mean(), y.std())
+            y = (y - y.mean()) / y.std()
 
-            for i in range(uniq.shape[0]):
-                (sel,) = np.where(ind == i)
-                tmp[:, i] = y[:, sel].mean(axis=1)
-            y = tmp
+            self._normalized = (x, y, xnorm, ynorm)
 
-        ynorm = (y.mean(), y.std())
-        y = (y - y.mean()) / y.std()
+        return self._normalized
 
-        return x, y, xnorm, ynorm
+    def invalidate(self):
+        """Discard the cached normalization, e.g. after modifying data in place."""
+        self._normalized = None
 
-    def save(self, d):
+    @property
+    def xnorm(self):
+        """Minimum and maximum of the time points."""
+        return self.normalize()[2]
+
+    @property
+    def ynorm(self):
+        """Mean and standard deviation of the (reduced) observations."""
+        return self.normalize()[3]
+
+    def derivatives(self, samp, functions=None, **kwargs):
+        """Draw derivatives of the latent functions for extracted posterior samples."""
+        x, _, _, _ = self.normalize()
+        return derivative.sample(
+            x,
+            samp["f"],
+            samp["alpha"],
+            samp["lengthscale"],
+            self.design.priors,
+            functions=functions,
+            **kwargs
+        )
+
+    def save(self, d, derivatives=False, format="npy", **kwargs):
+        """Save data, design and posteriors to directory d.
+
+        Posteriors are stored with phenom.posterior, extra keyword arguments
+        (dtype, compress) are passed to phenom.posterior.save. Use
+        format="pickle" for the pickled layout of earlier versions.
+        """
         if not os.path.exists(os.path.join(d, "samples")):
             os.makedirs(os.path.join(d, "samples"))
 
@@ -129,6 +357,29 @@ class Phenotype(object):
         self.design.frame.to_csv(os.path.join(d, "design.csv"))
 
         x, y, xnorm, ynorm = self.normalize()
+
+        with open(os.path.join(d, "phenotype.json"), "w") as fh:
+            json.dump(
+                {
+                    "model": self._modelFile,
+                    "alpha_priors": self.alpha_priors,
+                    "lengthscale_priors": self.lengthscale_priors,
+                    "sigma_prior": self.sigma_prior,
+                    "marginal_alpha_prior": self.marginal_alpha_prior,
+                    "marginal_lengthscale_prior": self.marginal_lengthscale_prior,
+                    "maxExpectedCross": self.maxExpectedCross,
+                    "minExpectedCross": self.minExpectedCross,
+                    "reduce": self.reduce,
+                    "basis_functions": self.basis_functions,
+                    "boundary_factor": self.boundary_factor,
+                    "threads": self.threads,
+                    "xnorm": [float(v) for v in xnorm],
+                    "ynorm": [float(v) for v in ynorm],
+                },
+                fh,
+                indent=2,
+            )
+
         pd.DataFrame(y, index=x).to_csv(os.path.join(d, "data-normalized.csv"))
 
         # pickle.dump(self, open(os.path.join(d, 'phenotype.pkl'), 'wb'))
@@ -136,20 +387,33 @@ class Phenotype(object):
         for i, p in enumerate(self.posteriors):
             samp = p.extract()
 
-            # unnormalized
-            x, y, xnorm, ynorm = self.normalize()
-            ymean, ystd = ynorm
-            xmin, xmax = xnorm
-
-            samp["f-native"] = samp["f"] * ystd
-            samp["f-native"][:, 0] += ymean
-
-            if "df" in samp:
-                samp["df-native"] = samp["df"] * ystd / (xmax - xmin)
-
-            pickle.dump(
-                samp, open(os.path.join(d, "samples", "posterior_%d.pkl" % i), "wb")
-            )
+            if derivatives and "df" not in samp:
+                samp["df"] = self.derivatives(samp)
+
+            if format == "pickle":
+                # unnormalized
+                ymean, ystd = ynorm
+                xmin, xmax = xnorm
+
+                samp["f-native"] = samp["f"] * ystd
+                samp["f-native"][:, 0] += ymean
+
+                if "df" in samp:
+                    samp["df-native"] = samp["df"] * ystd / (xmax - xmin)
+
+                pickle.dump(
+                    samp,
+                    open(os.path.join(d, "samples", "posterior_%d.pkl" % i), "wb"),
+                )
+            else:
+                posterior.save(
+                    samp,
+                    os.path.join(d, "samples", "posterior_%d" % i),
+                    xnorm,
+                    ynorm,
+                    adaptation=fit.adaptation(p),
+                    **kwargs
+                )
 
             summary = p.summary()
             summary = pd.DataFrame(
@@ -159,9 +423,266 @@ class Phenotype(object):
             )
             summary.to_csv(os.path.join(d, "samples", "posterior_%d.csv" % i))
 
-    def samples(self, *args, **kwargs):
+            if "increments" in getattr(p, "info", {}):
+                pd.DataFrame(p.info["increments"]).to_csv(
+                    os.path.join(d, "samples", "posterior_%d-increments.csv" % i),
+                    index=False,
+                )
+
+    def samples(self, *args, init=None, target=None, memoize=False, **kwargs):
+        """Sample the posterior with NUTS, arguments are passed to StanModel.sampling.
+
+        init can also be a fit to start the chains from, see warmstart. If it
+        recorded the step size and inverse metric NUTS adapted to, they are
+        added to control (unless it sets them already) and warmup is shortened
+        to WARM_WARMUP iterations, keeping the number of draws, unless warmup
+        is given explicitly.
+
+        With a diagnostics.Target, the chains are sampled in increments of
+        target.increment iterations after warmup until its R-hat and ESS
+        targets are met, and the draws are returned as a phenom.fit.Fit whose
+        info["increments"] records the diagnostics and time of each increment.
+
+        With memoize, a posterior sampled before from the same data, program and
+        arguments is loaded from phenom.cache instead, as a phenom.fit.Fit,
+        and new posteriors are stored there.
+        """
         cfg = self.config()
-        samp = self.model.sampling(data=cfg, *args, **kwargs)
+
+        if (
+            isinstance(init, (approx.Approx, approx.Kronecker))
+            or (isinstance(init, str) and init not in ("random", "0"))
+            or hasattr(init, "extract")
+        ):
+            init, adaptation = self.warmstart(init, kwargs.get("chains", 4))
+
+            if adaptation is not None:
+                # settings the caller passes in control take precedence
+                control = dict(kwargs.get("control") or {})
+                control.setdefault("stepsize", float(np.median(adaptation["stepsize"])))
+                control.setdefault(
+                    "inv_metric", np.mean(adaptation["inv_metric"], axis=0)
+                )
+                kwargs["control"] = control
+
+                if "warmup" not in kwargs:
+                    iterations = kwargs.get("iter", 2000)
+                    kwargs["iter"] = iterations - iterations // 2 + WARM_WARMUP
+                    kwargs["warmup"] = WARM_WARMUP
+
+        if init is not None:
+            kwargs["init"] = init
+
+        samp = None
+        if memoize:
+            d, _ = os.path.split(__file__)
+            with open(os.path.join(d, "stan", self.program)) as fh:
+                code = fh.read()
+
+            key = cache.posterior_key(cfg, code, *args, target=target, **kwargs)
+            samp = cache.load_posterior(key)
+
+        if samp is None:
+            with self.threading():
+                if target is None:
+                    samp = self.model.sampling(data=cfg, *args, **kwargs)
+                else:
+                    samp = self._increments(cfg, target, args, kwargs)
+
+            if memoize:
+                cache.store_posterior(key, samp, self.program)
 
         self.posteriors.append(samp)
         return samp
+
+    def _increments(self, cfg, target, args, kwargs):
+        """Sample until target is met, continuing the chains of each increment in the next."""
+        warmup = kwargs.get("warmup", kwargs.get("iter", 2000) // 2)
+        kwargs = dict(kwargs, warmup=warmup, iter=warmup + target.increment)
+
+        draws, history, adaptation = None, [], None
+        for i in range(target.max_increments):
+            start = time.time()
+            stanfit = self.model.sampling(data=cfg, *args, **kwargs)
+            seconds = time.time() - start
+
+            new = fit.chains(stanfit)
+            if draws is None:
+                draws = new
+                adaptation = fit.adaptation(stanfit)
+            else:
+                draws = {k: np.concatenate((draws[k], new[k])) for k in draws}
+
+            check = target.check(draws)
+            history.append(
+                dict(
+                    increment=i,
+                    iterations=draws["lp__"].shape[0],
+                    seconds=seconds,
+                    **check
+                )
+            )
+            if check["converged"]:
+                break
+
+            # later increments continue every chain from its last draw, with
+            # the adaptation of the first one, or, if the fit does not report
+            # it, after a short warmup of their own
+            skip = {"lp__", "f", "df"}
+            warmup = 0 if adaptation is not None else WARM_WARMUP
+            kwargs = dict(
+                kwargs,
+                warmup=warmup,
+                iter=warmup + target.increment,
+                init=[
+                    {k: v[-1, c] for k, v in draws.items() if k not in skip}
+                    for c in range(draws["lp__"].shape[1])
+                ],
+            )
+            if adaptation is not None:
+                kwargs["control"] = dict(
+                    kwargs.get("control") or {},
+                    adapt_engaged=False,
+                    stepsize=float(np.median(adaptation["stepsize"])),
+                    inv_metric=np.mean(adaptation["inv_metric"], axis=0),
+                )
+            if kwargs.get("seed") is not None:
+                kwargs["seed"] += 1
+
+        return fit.Fit.fromChains(
+            draws, "nuts", {"increments": history, "adaptation": adaptation}
+        )
+
+    def warmstart(self, source, chains=4):
+        """Initial values for chains from an earlier fit of this model, and its NUTS adaptation.
+
+        source is one of
+            an approx.Approx or fitted approx.Kronecker model
+            a directory written by save, or a saved posterior in it
+            a Stan fit or a phenom.fit.Fit
+        Fits must be of the same model on data of the same shape. Chains start
+        from draws spread over the fit; all of them start from the
+        approximation's posterior mean. Returns the inits and the adapted
+        step sizes and inverse metrics of the chains, or None if unknown.
+        """
+        if isinstance(source, approx.Approx):
+            source = source.model()
+
+        if isinstance(source, approx.Kronecker):
+            return [self._approxInit(source)] * chains, None
+
+        # computed from the parameters
+        skip = {"lp__", "f", "df"} | set(posterior.NATIVE)
+
+        def spread(n):
+            """Draws the chains start from, spread over n."""
+            return np.linspace(0, n - 1, chains).round().astype(int)
+
+        if isinstance(source, str) and os.path.isdir(os.path.join(source, "samples")):
+            source = posterior.path(os.path.join(source, "samples"), 0)
+
+        if isinstance(source, str) and os.path.isdir(source):
+            # read only the parameters, and only at the draws the chains start from
+            post = posterior.Posterior(source)
+            adaptation = post.index.get("adaptation")
+            samp = {
+                k: np.asarray(post.read(k, spread(post.draws)))
+                for k in post.variables
+                if k not in skip
+            }
+        else:
+            if isinstance(source, str):
+                adaptation, samp = None, posterior.load(source)
+            else:
+                adaptation, samp = fit.adaptation(source), source.extract()
+
+            samp = {
+                k: np.asarray(v)[spread(len(v))]
+                for k, v in samp.items()
+                if k not in skip
+            }
+
+        inits = [{k: v[i] for k, v in samp.items()} for i in range(chains)]
+
+        for i in inits:
+            if "lengthscale" in i:
+                i["lengthscale"] = self._lengthscaleBounds(i["lengthscale"])
+
+        return inits, adaptation
+
+    def _lengthscaleBounds(self, lengthscale):
+        """Lengthscales moved strictly inside the bounds of the model."""
+        lower, upper = self.lengthscaleRange()
+        return np.clip(lengthscale, lower * (1 + 1e-6), upper * (1 - 1e-6))
+
+    def _approxInit(self, m):
+        """Parameters matching the posterior mean of a Kronecker model."""
+        x, _, _, _ = self.normalize()
+
+        lengthscale = float(self._lengthscaleBounds(m.lengthscale))
+        alpha = np.sqrt(m.variance)
+
+        init = {
+            "lengthscale": np.full(alpha.shape[0], lengthscale),
+            "alpha": alpha,
+            "sigma": float(np.sqrt(m.noise)),
+        }
+
+        if self._modelFile == "phenom_hsgp.stan":
+            # basis coefficients are left to Stan
+            return init
+
+        # f = L_cov f_eta with the kernel of each prior as in the Stan programs,
+        # directions the kernel all but removes are left at zero
+        f = m.functions()
+        kx = np.exp(-0.5 * (x[:, None] - x[None, :]) ** 2 / lengthscale ** 2)
+
+        f_eta = np.zeros_like(f)
+        for l, a in enumerate(alpha):
+            sel = self.design.priors == l
+            root = derivative._sqrt(a ** 2 * kx + 1e-12 * np.eye(x.shape[0]))
+            f_eta[sel] = np.linalg.lstsq(root, f[sel].T, rcond=1e-6)[0].T
+
+        init["f_eta"] = f_eta
+        return init
+
+    def optimize(self, *args, **kwargs):
+        """Posterior mode from Stan's optimizer, as a phenom.fit.Fit with one draw.
+
+        Arguments are passed to StanModel.optimizing. The fit is added to
+        posteriors, so it is saved like a sampled posterior.
+        """
+        cfg = self.config()
+        with self.threading():
+            opt = self.model.optimizing(data=cfg, *args, **kwargs)
+
+        if "par" in opt:
+            # as_vector=False
+            opt = opt["par"]
+
+        result = fit.Fit(
+            {k: np.asarray(v, dtype=float)[None] for k, v in opt.items()}, "optimize"
+        )
+
+        self.posteriors.append(result)
+        return result
+
+    def variational(self, *args, **kwargs):
+        """Draws from Stan's mean field (or full rank) ADVI approximation, as a phenom.fit.Fit.
+
+        Arguments are passed to StanModel.vb, e.g. output_samples or
+        algorithm="fullrank". The fit is added to posteriors, so it is saved
+        like a sampled posterior.
+        """
+        cfg = self.config()
+        with self.threading():
+            vb = self.model.vb(data=cfg, *args, **kwargs)
+
+        result = fit.Fit(
+            fit.unflatten(vb["sampler_param_names"], vb["sampler_params"]),
+            "variational",
+            {"args": vb.get("args")},
+        )
+
+        self.posteriors.append(result)
+        return result
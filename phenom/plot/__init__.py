@@ -1,2 +1,14 @@
-from . import function
-from . import hyperparam
+import importlib
+
+# matplotlib is only loaded once a plotting module is used
+_submodules = ["function", "hyperparam"]
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + _submodules)
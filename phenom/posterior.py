@@ -0,0 +1,215 @@
+"""Columnar storage of posterior samples.
+
+A posterior is saved as a directory holding one array file per variable and an
+``index.json`` describing them, so a single variable (and a range of draws)
+can be read without loading the rest:
+
+    posterior_0/
+        index.json
+        f.npy
+        alpha.npy
+        ...
+
+Uncompressed variables are ``.npy`` files that are memory mapped on read.
+Compressed variables are ``.npz`` files holding the draws in chunks, of which
+only those covering the requested draws are decompressed. The ``-native``
+variables are not stored, they are computed on read from the normalization
+constants in the index. Posteriors pickled by earlier versions of
+``Phenotype.save`` can still be read with ``load``.
+"""
+import json
+import os
+import pickle
+from collections.abc import Mapping
+
+import numpy as np
+
+FORMAT = 1
+
+# variables rescaled to the units of the data on read
+NATIVE = {"f-native": "f", "df-native": "df"}
+
+
+def save(
+    samp,
+    d,
+    xnorm=None,
+    ynorm=None,
+    dtype=None,
+    compress=False,
+    chunk=250,
+    adaptation=None,
+):
+    """Save extracted samples to directory d.
+
+    dtype: downcast floating point variables, e.g. np.float32
+    compress: store variables compressed, in chunks of chunk draws
+    adaptation: step size and inverse metric of each chain (see
+        phenom.fit.adaptation), kept to warm start later runs
+    """
+    from .dataset import _replace
+
+    os.makedirs(d, exist_ok=True)
+
+    variables = {}
+    for name, value in samp.items():
+        if name in NATIVE:
+            continue
+
+        value = np.asarray(value)
+        if dtype is not None and np.issubdtype(value.dtype, np.floating):
+            value = value.astype(dtype)
+
+        info = {"shape": list(value.shape), "dtype": value.dtype.str}
+
+        if compress:
+            info["file"] = name + ".npz"
+            info["chunk"] = chunk
+
+            chunks = {
+                "chunk_%d" % i: value[start : start + chunk]
+                for i, start in enumerate(range(0, max(value.shape[0], 1), chunk))
+            }
+            _replace(
+                os.path.join(d, info["file"]),
+                lambda fh: np.savez_compressed(fh, **chunks),
+            )
+        else:
+            info["file"] = name + ".npy"
+            _replace(os.path.join(d, info["file"]), lambda fh: np.save(fh, value))
+
+        variables[name] = info
+
+    index = {
+        "format": FORMAT,
+        "variables": variables,
+        "xnorm": None if xnorm is None else [float(v) for v in xnorm],
+        "ynorm": None if ynorm is None else [float(v) for v in ynorm],
+        "adaptation": adaptation,
+    }
+
+    # the index is written last, a posterior without one is incomplete
+    _replace(
+        os.path.join(d, "index.json"),
+        lambda fh: fh.write(json.dumps(index, indent=2).encode("utf-8")),
+    )
+
+    # variables of an earlier posterior saved to d
+    files = {info["file"] for info in variables.values()}
+    for f in os.listdir(d):
+        if f.endswith((".npy", ".npz")) and f not in files:
+            os.remove(os.path.join(d, f))
+
+
+class Posterior(Mapping):
+    """Read-only, lazily loaded view of a saved posterior."""
+
+    def __init__(self, d):
+        self.directory = d
+
+        with open(os.path.join(d, "index.json")) as fh:
+            self.index = json.load(fh)
+
+    @property
+    def variables(self):
+        return self.index["variables"]
+
+    @property
+    def draws(self):
+        return next(iter(self.variables.values()))["shape"][0]
+
+    def __iter__(self):
+        yield from self.variables
+        for native, name in NATIVE.items():
+            if name in self.variables and self.index["ynorm"] is not None:
+                yield native
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __getitem__(self, name):
+        if name not in self.variables and name not in NATIVE:
+            raise KeyError(name)
+        return self.read(name)
+
+    def read(self, name, draws=None, function=None):
+        """Read a variable.
+
+        draws: only read the draws selected by a slice or index array
+        function: only read this index along the function axis of f and df
+        """
+
+        if name in NATIVE:
+            return self._native(name, draws, function)
+
+        info = self.variables[name]
+        path = os.path.join(self.directory, info["file"])
+
+        if info["file"].endswith(".npy"):
+            value = np.load(path, mmap_mode="r")
+            if draws is not None:
+                value = value[draws]
+            return value if function is None else value[:, function]
+
+        n = info["shape"][0]
+        ind = np.arange(n) if draws is None else np.arange(n)[draws]
+        chunk = info["chunk"]
+
+        shape = info["shape"][1:]
+        if function is not None:
+            shape = shape[1:]
+
+        value = np.empty((ind.shape[0],) + tuple(shape), dtype=info["dtype"])
+        with np.load(path) as npz:
+            for c in np.unique(ind // chunk):
+                (sel,) = np.where(ind // chunk == c)
+                part = npz["chunk_%d" % c][ind[sel] - c * chunk]
+                value[sel] = part if function is None else part[:, function]
+
+        return value
+
+    def _native(self, name, draws, function):
+        ymean, ystd = self.index["ynorm"]
+        xmin, xmax = self.index["xnorm"]
+
+        value = np.array(self.read(NATIVE[name], draws, function), dtype=float) * ystd
+
+        if name == "df-native":
+            value /= xmax - xmin
+        elif function is None:
+            value[:, 0] += ymean
+        elif function == 0:
+            value += ymean
+
+        return value
+
+
+def path(d, i):
+    """Location of posterior i in samples directory d, in either layout, or None."""
+    for p in (
+        os.path.join(d, "posterior_%d" % i, "index.json"),
+        os.path.join(d, "posterior_%d.pkl" % i),
+    ):
+        if os.path.exists(p):
+            return os.path.dirname(p) if p.endswith("index.json") else p
+    return None
+
+
+def load(p, variables=None, draws=None):
+    """Load a saved posterior, either a directory or a pickle, into a dict of arrays."""
+
+    if os.path.isdir(p):
+        post = Posterior(p)
+        if variables is None:
+            variables = list(post)
+        return {v: np.asarray(post.read(v, draws)) for v in variables}
+
+    with open(p, "rb") as fh:
+        samp = pickle.load(fh)
+
+    if variables is None:
+        variables = list(samp)
+
+    return {
+        v: samp[v] if draws is None else np.asarray(samp[v])[draws] for v in variables
+    }
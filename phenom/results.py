@@ -0,0 +1,170 @@
+"""Index of saved Phenotype runs.
+
+An output tree (e.g. ``sampling/``) is scanned once for directories written
+by ``Phenotype.save``, recording for each run where it came from and which
+functions its design estimates. Posterior summaries are then streamed one
+posterior, and one function, at a time so comparing many runs never needs
+more than a single function's draws in memory.
+
+Runs laid out as the sampling scripts do,
+``<organism>/<combined|individual>/<condition>/<model or dataset>``, have
+these fields filled in from their path.
+"""
+import json
+import os
+
+import attr
+import numpy as np
+import pandas as pd
+
+from . import posterior
+
+KINDS = ["combined", "individual"]
+
+
+@attr.s
+class Run(object):
+
+    path = attr.ib()
+    functions = attr.ib()
+    posteriors = attr.ib()
+
+    organism = attr.ib(default=None)
+    kind = attr.ib(default=None)
+    condition = attr.ib(default=None)
+    model = attr.ib(default=None)
+    dataset = attr.ib(default=None)
+
+    # Stan program the run was sampled with
+    program = attr.ib(default=None)
+
+    @classmethod
+    def fromDirectory(cls, d):
+        functions = pd.read_csv(os.path.join(d, "design.csv"), nrows=0).columns[1:]
+
+        samples = os.path.join(d, "samples")
+        posteriors = []
+        while posterior.path(samples, len(posteriors)) is not None:
+            posteriors.append(posterior.path(samples, len(posteriors)))
+
+        run = cls(d, functions.tolist(), posteriors)
+
+        parts = os.path.normpath(d).split(os.sep)
+        if len(parts) >= 4 and parts[-3] in KINDS:
+            run.organism, run.kind, run.condition = parts[-4:-1]
+            if run.kind == "combined":
+                run.model = parts[-1]
+            else:
+                run.dataset = parts[-1]
+
+        if os.path.exists(os.path.join(d, "phenotype.json")):
+            with open(os.path.join(d, "phenotype.json")) as fh:
+                run.program = json.load(fh)["model"]
+
+        return run
+
+    @property
+    def time(self):
+        return pd.read_csv(os.path.join(self.path, "data.csv"), usecols=[0]).iloc[
+            :, 0
+        ].values
+
+    def metadata(self):
+        return {
+            "path": self.path,
+            "organism": self.organism,
+            "kind": self.kind,
+            "condition": self.condition,
+            "model": self.model,
+            "dataset": self.dataset,
+            "program": self.program,
+        }
+
+
+class Index(object):
+    def __init__(self, runs):
+        self.runs = runs
+
+    @classmethod
+    def scan(cls, root):
+        """Find every saved run below root."""
+        runs = []
+        for d, dirs, files in os.walk(root):
+            dirs.sort()
+            if "design.csv" in files and "samples" in dirs:
+                runs.append(Run.fromDirectory(d))
+                # posteriors are not runs themselves
+                dirs.remove("samples")
+
+        return cls(runs)
+
+    @property
+    def frame(self):
+        """Run metadata, one row per run."""
+        rows = []
+        for r in self.runs:
+            row = r.metadata()
+            row["functions"] = len(r.functions)
+            row["posteriors"] = len(r.posteriors)
+            rows.append(row)
+
+        return pd.DataFrame(rows)
+
+    def select(self, **kwargs):
+        """Runs whose metadata match every keyword, e.g. select(condition='hi')."""
+        return Index(
+            [
+                r
+                for r in self.runs
+                if all(getattr(r, k) == v for k, v in kwargs.items())
+            ]
+        )
+
+    def stream(self, variable="f-native", conf=0.95, functions=None):
+        """Yield a summary frame per posterior of every run.
+
+        Each frame holds the posterior mean and central conf interval of
+        variable for every function (or only those named in functions) at
+        every time point, tagged with the run metadata.
+        """
+
+        lo, hi = (1 - conf) / 2, 1 - (1 - conf) / 2
+
+        for r in self.runs:
+            time = r.time
+
+            for i, p in enumerate(r.posteriors):
+                if os.path.isdir(p):
+                    # only the draws of one function are read at a time
+                    post = posterior.Posterior(p)
+                    read = lambda k: post.read(variable, function=k)
+                else:
+                    # pickles can only be read whole
+                    values = posterior.load(p, [variable])[variable]
+                    read = lambda k: values[:, k, :]
+
+                for k, name in enumerate(r.functions):
+                    if functions is not None and name not in functions:
+                        continue
+
+                    draws = np.asarray(read(k))
+
+                    frame = pd.DataFrame(
+                        {
+                            "function": name,
+                            "time": time,
+                            "mean": draws.mean(0),
+                            "lower": np.quantile(draws, lo, axis=0),
+                            "upper": np.quantile(draws, hi, axis=0),
+                        }
+                    )
+
+                    frame["posterior"] = i
+                    for key, value in r.metadata().items():
+                        frame[key] = value
+
+                    yield frame
+
+    def summary(self, *args, **kwargs):
+        """All summaries of stream in one frame."""
+        return pd.concat(list(self.stream(*args, **kwargs)), ignore_index=True)
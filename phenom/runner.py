@@ -0,0 +1,145 @@
+"""Run many sampling jobs on one machine.
+
+A job describes how to build a Phenotype and where to save its posterior. Jobs
+are spread over a process pool sized so that the chains of all running jobs
+fill the available cores without oversubscribing them, and jobs whose output
+already exists are skipped so an interrupted sweep can be resumed.
+
+Designs built with patsy cannot be pickled, so a job holds a module level
+function that builds its Phenotype inside the worker rather than the
+Phenotype itself. Compiled models are shared through phenom.cache: the first
+worker to need a program compiles it while the others wait for it.
+
+From the command line, each argument names a function returning a list of jobs:
+
+    python -m phenom.runner hsalinarum:jobs paeruginosa:jobs --chains 4
+"""
+import importlib
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import attr
+
+from . import posterior
+
+
+@attr.s
+class Job(object):
+
+    # directory the phenotype is saved to
+    output = attr.ib()
+
+    # module level function returning a Phenotype, called as phenotype(*args)
+    phenotype = attr.ib()
+    args = attr.ib(default=())
+
+    # keyword arguments to Phenotype.samples and Phenotype.save
+    sampling = attr.ib(factory=dict)
+    save = attr.ib(factory=dict)
+
+    def done(self):
+        return posterior.path(os.path.join(self.output, "samples"), 0) is not None
+
+    def run(self):
+        os.makedirs(self.output, exist_ok=True)
+
+        with redirect(self.output):
+            phen = self.phenotype(*self.args)
+            phen.samples(**self.sampling)
+            phen.save(self.output, **self.save)
+
+        return self.output
+
+
+@contextmanager
+def redirect(d):
+    """Send this process's stdout and stderr, including Stan's, to log files in d."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+
+    with open(os.path.join(d, "log.out"), "w") as out, open(
+        os.path.join(d, "log.err"), "w"
+    ) as err:
+        os.dup2(out.fileno(), 1)
+        os.dup2(err.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+
+
+def run(jobs, chains=4, processes=None, resume=True):
+    """Run jobs in parallel, returning the failed jobs with their tracebacks.
+
+    Each job samples chains chains in parallel, so by default
+    cpu_count // chains jobs run at once.
+    """
+
+    if resume:
+        jobs = [j for j in jobs if not j.done()]
+
+    for j in jobs:
+        j.sampling.setdefault("chains", chains)
+        j.sampling.setdefault("n_jobs", j.sampling["chains"])
+
+    if processes is None:
+        processes = max(1, (os.cpu_count() or 1) // chains)
+
+    failed = []
+    if len(jobs) == 0:
+        return failed
+
+    with ProcessPoolExecutor(max_workers=min(processes, len(jobs))) as pool:
+        futures = {pool.submit(j.run): j for j in jobs}
+
+        for fut in as_completed(futures):
+            job = futures[fut]
+            try:
+                print("finished {}".format(fut.result()), flush=True)
+            except Exception:
+                failed.append((job, traceback.format_exc()))
+                print("failed {}".format(job.output), flush=True)
+
+    return failed
+
+
+def load(spec):
+    """Resolve a 'module:function' specification and call it for its jobs."""
+    module, function = spec.split(":")
+    return getattr(importlib.import_module(module), function)()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("jobs", nargs="+", help="module:function returning jobs")
+    parser.add_argument("--chains", type=int, default=4)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--no-resume", dest="resume", action="store_false")
+
+    args = parser.parse_args()
+
+    # allow job modules next to where the runner is started
+    sys.path.insert(0, os.getcwd())
+
+    jobs = []
+    for spec in args.jobs:
+        jobs += load(spec)
+
+    failed = run(jobs, args.chains, args.processes, args.resume)
+
+    for job, tb in failed:
+        print(job.output, file=sys.stderr)
+        print(tb, file=sys.stderr)
+
+    sys.exit(1 if failed else 0)
@@ -15,19 +15,10 @@ def load_data(condition, dataset, DATA_DIR="../data"):
 
     # load data
     if dataset is None:
-        ds = None
+        dirs = [os.path.join(DATA_DIR, dr) for dr in os.listdir(DATA_DIR)]
+        dirs = [dr for dr in dirs if os.path.isdir(dr)]
 
-        for dr in os.listdir(DATA_DIR):
-
-            if not os.path.isdir(os.path.join(DATA_DIR, dr)):
-                continue
-
-            if ds is None:
-                ds = phenom.dataset.DataSet.fromDirectory(os.path.join(DATA_DIR, dr))
-            else:
-                ds = ds.concat(
-                    phenom.dataset.DataSet.fromDirectory(os.path.join(DATA_DIR, dr))
-                )
+        ds = phenom.dataset.DataSet.fromDirectories(dirs, workers=4)
     else:
         ds = phenom.dataset.DataSet.fromDirectory(os.path.join(DATA_DIR, dataset))
 
@@ -39,19 +30,9 @@ def load_data(condition, dataset, DATA_DIR="../data"):
     return ds
 
 
-if __name__ == "__main__":
-    import argparse
+def phenotype(condition, model, dataset=None, DATA_DIR="../data"):
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("condition", choices=["standard", "low", "hi"])
-    parser.add_argument("model", choices=["mnull", "mbatch", "mfull"])
-    parser.add_argument("--adapt_delta", type=float, default=0.8)
-    parser.add_argument("--max_treedepth", type=int, default=10)
-    parser.add_argument("--dataset", default=None)
-
-    args = parser.parse_args()
-
-    ds = load_data(args.condition, args.dataset)
+    ds = load_data(condition, dataset, DATA_DIR)
 
     # designs
     mnull = phenom.design.Formula(ds.meta, "C(mMPQ, Sum)")
@@ -62,13 +43,13 @@ if __name__ == "__main__":
     mbatch = mnull * hierarchy
 
     # phenotype
-    if args.model == "mnull":
+    if model == "mnull":
         phen = phenom.phenotype.Phenotype(ds.data, mnull, model="phenom.stan")
-    elif args.model == "mbatch":
+    elif model == "mbatch":
         phen = phenom.phenotype.Phenotype(
             ds.data,
             mbatch,
-            model="phenom_deriv.stan",
+            model="phenom.stan",
             lengthscale_priors=[[6, 1], [6, 1], [6, 1], [6, 1]],
             alpha_priors=[[10.0, 10.0], [10.0, 10.0], [7.0, 10.0], [7.0, 10.0]],
             minExpectedCross=0.1,
@@ -89,13 +70,70 @@ if __name__ == "__main__":
             sigma_prior=[0.02, 20],
         )
 
+    return phen
+
+
+def output(condition, model, dataset=None):
+    if dataset is None:
+        return "hsalinarum/combined/{}/{}".format(condition, model)
+    return "hsalinarum/individual/{}/{}".format(condition, dataset)
+
+
+def jobs(adapt_delta=0.95, max_treedepth=20, DATA_DIR="../data"):
+    """Every combined and individual fit of the sweep, for phenom.runner."""
+    from phenom.runner import Job
+
+    control = dict(adapt_delta=adapt_delta, max_treedepth=max_treedepth)
+    batches = sorted(
+        d
+        for d in os.listdir(os.path.join(DATA_DIR, "hi-oxidative"))
+        if os.path.isdir(os.path.join(DATA_DIR, "hi-oxidative", d))
+    )
+
+    ret = []
+    for condition in ["low", "hi"]:
+        for model in ["mnull", "mbatch", "mfull"]:
+            ret.append(
+                Job(
+                    output(condition, model),
+                    phenotype,
+                    (condition, model, None, DATA_DIR),
+                    sampling=dict(control=control),
+                    save=dict(derivatives=True),
+                )
+            )
+        for batch in batches:
+            ret.append(
+                Job(
+                    output(condition, "mnull", batch),
+                    phenotype,
+                    (condition, "mnull", batch, DATA_DIR),
+                    sampling=dict(control=control),
+                    save=dict(derivatives=True),
+                )
+            )
+
+    return ret
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("condition", choices=["standard", "low", "hi"])
+    parser.add_argument("model", choices=["mnull", "mbatch", "mfull"])
+    parser.add_argument("--adapt_delta", type=float, default=0.8)
+    parser.add_argument("--max_treedepth", type=int, default=10)
+    parser.add_argument("--dataset", default=None)
+
+    args = parser.parse_args()
+
+    phen = phenotype(args.condition, args.model, args.dataset)
+
     # sampling
     samples = phen.samples(
         control=dict(adapt_delta=args.adapt_delta, max_treedepth=args.max_treedepth)
     )
 
     # save
-    if args.dataset is None:
-        phen.save("hsalinarum/combined/{}/{}".format(args.condition, args.model))
-    else:
-        phen.save("hsalinarum/individual/{}/{}".format(args.condition, args.dataset))
+    phen.save(output(args.condition, args.model, args.dataset), derivatives=True)
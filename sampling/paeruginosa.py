@@ -1,29 +1,24 @@
+import os
+
+import pandas as pd
+
 import phenom
 
-if __name__ == "__main__":
-    import argparse
+DATA_DIR = "../data/pseudomonas"
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("acid", choices=["benzoate", "citric", "malic"])
-    parser.add_argument(
-        "model",  choices=["mnull", "mbatch", "mfull"]
-    )
-    parser.add_argument("--adapt_delta", type=float, default=0.8)
-    parser.add_argument("--max_treedepth", type=int, default=10)
-    parser.add_argument("--dataset", default=None)
 
-    args = parser.parse_args()
+def phenotype(acid, model, dataset=None, DATA_DIR=DATA_DIR):
 
     ds = phenom.dataset.DataSet.fromDirectory(
-        "../data/pseudomonas/PA01-{}/".format(args.acid)
+        os.path.join(DATA_DIR, "PA01-{}/".format(acid))
     )
     ds.meta["mMAcid"] = ds.meta["mM-acid"]
     ds.data = ds.data.iloc[6::3, :]
     ds.log()
 
-    if args.dataset is not None:
-        ds.data = ds.data.loc[:, ds.meta.plate.str.replace(" ", "_") == args.dataset]
-        ds.meta = ds.meta.loc[ds.meta.plate.str.replace(" ", "_") == args.dataset, :]
+    if dataset is not None:
+        ds.data = ds.data.loc[:, ds.meta.plate.str.replace(" ", "_") == dataset]
+        ds.meta = ds.meta.loc[ds.meta.plate.str.replace(" ", "_") == dataset, :]
 
     # designs
     formula = """1 + C(mMAcid, Sum, levels=[5, 10, 20, 0]) 
@@ -38,20 +33,20 @@ if __name__ == "__main__":
     mbatch = mnull * hierarchy
 
     # phenotype
-    if args.model == "mnull":
-        phen = phenom.phenotype.Phenotype(ds.data, mnull, model="phenom_deriv.stan")
-    elif args.model == "mbatch":
+    if model == "mnull":
+        phen = phenom.phenotype.Phenotype(ds.data, mnull, model="phenom.stan")
+    elif model == "mbatch":
         phen = phenom.phenotype.Phenotype(
             ds.data,
             mbatch,
-            model="phenom_deriv.stan",
+            model="phenom.stan",
             lengthscale_priors=[[2, 3]] * 4 + [[10, 1]] * 4,
             alpha_priors=[[10, 10]] * 4 + [[7, 10]] * 4,
             minExpectedCross=0.01,
             maxExpectedCross=10,
             sigma_prior=[0.02, 20],
         )
-    elif args.model == "mfull":
+    elif model == "mfull":
         phen = phenom.phenotype.Phenotype(
             ds.data,
             mbatch,
@@ -65,7 +60,66 @@ if __name__ == "__main__":
             marginal_alpha_prior=[5, 50],
         )
     else:
-        raise ValueError("Unknown model: {}!".format(args.model))
+        raise ValueError("Unknown model: {}!".format(model))
+
+    return phen
+
+
+def output(acid, model, dataset=None):
+    if dataset is None:
+        return "paeruginosa/combined/{}/{}".format(acid, model)
+    return "paeruginosa/individual/{}/{}".format(acid, dataset)
+
+
+def jobs(adapt_delta=0.95, max_treedepth=15, DATA_DIR=DATA_DIR):
+    """Every combined and individual fit of the sweep, for phenom.runner."""
+    from phenom.runner import Job
+
+    control = dict(adapt_delta=adapt_delta, max_treedepth=max_treedepth)
+
+    ret = []
+    for acid in ["benzoate", "citric", "malic"]:
+        for model in ["mnull", "mbatch", "mfull"]:
+            ret.append(
+                Job(
+                    output(acid, model),
+                    phenotype,
+                    (acid, model, None, DATA_DIR),
+                    sampling=dict(control=control),
+                    save=dict(derivatives=True),
+                )
+            )
+
+        meta = pd.read_csv(os.path.join(DATA_DIR, "PA01-{}".format(acid), "meta.csv"))
+        for plate in meta.plate.str.replace(" ", "_").unique():
+            ret.append(
+                Job(
+                    output(acid, "mnull", plate),
+                    phenotype,
+                    (acid, "mnull", plate, DATA_DIR),
+                    sampling=dict(control=control),
+                    save=dict(derivatives=True),
+                )
+            )
+
+    return ret
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("acid", choices=["benzoate", "citric", "malic"])
+    parser.add_argument(
+        "model",  choices=["mnull", "mbatch", "mfull"]
+    )
+    parser.add_argument("--adapt_delta", type=float, default=0.8)
+    parser.add_argument("--max_treedepth", type=int, default=10)
+    parser.add_argument("--dataset", default=None)
+
+    args = parser.parse_args()
+
+    phen = phenotype(args.acid, args.model, args.dataset)
 
     # sampling
     samples = phen.samples(
@@ -73,7 +127,4 @@ if __name__ == "__main__":
     )
 
     # save
-    if args.dataset is None:
-        phen.save("paeruginosa/combined/{}/{}".format(args.acid, args.model))
-    else:
-        phen.save("paeruginosa/individual/{}/{}".format(args.acid, args.dataset))
+    phen.save(output(args.acid, args.model, args.dataset), derivatives=True)
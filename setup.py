@@ -40,7 +40,7 @@ setup(
 
     keywords='statistics microbiology',
 
-    packages=find_packages(exclude=['data', 'tests']),
+    packages=find_packages(exclude=['data', 'tests', 'benchmarks']),
     include_package_data=True,
     package_data={'phenom': ['stan/*.stan']},
 
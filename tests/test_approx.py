@@ -0,0 +1,61 @@
+import numpy as np
+from scipy.stats import multivariate_normal
+
+from phenom.approx import Kronecker
+
+
+def model():
+    rng = np.random.RandomState(0)
+    x = np.linspace(0, 1, 7)
+    design = np.column_stack(
+        [np.ones(6), np.repeat([0.0, 1.0], 3), np.tile([0.0, 1.0], 3)]
+    )
+
+    return Kronecker(
+        x,
+        design,
+        rng.normal(size=(7, 6)),
+        [0, 1, 1],
+        lengthscale=0.3,
+        variance=[1.5, 0.5],
+        noise=0.2,
+    )
+
+
+def test_log_likelihood_matches_dense():
+    m = model()
+
+    # columns of y stacked, so the covariance is Kd (x) Kx
+    cov = np.kron(m.kd(), m.kx()) + m.noise * np.eye(m.y.size)
+    expected = multivariate_normal(np.zeros(m.y.size), cov).logpdf(m.y.T.ravel())
+
+    np.testing.assert_allclose(m.log_likelihood(), expected)
+
+
+def test_gradient_matches_finite_differences():
+    m = model()
+    params = m.params
+    gradient = m.gradient()
+
+    eps = 1e-6
+    numeric = []
+    for i in range(params.shape[0]):
+        step = np.zeros_like(params)
+        step[i] = eps
+
+        m.params = params + step
+        up = m.log_likelihood()
+        m.params = params - step
+        down = m.log_likelihood()
+
+        numeric.append((up - down) / (2 * eps))
+
+    np.testing.assert_allclose(gradient, numeric, rtol=1e-5, atol=1e-6)
+
+
+def test_value_and_grad():
+    m = model()
+    value, gradient = m._value_and_grad()
+
+    np.testing.assert_allclose(value, m.log_likelihood())
+    np.testing.assert_allclose(gradient, m.gradient())
@@ -0,0 +1,124 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from phenom.dataset import CACHE, DataSet
+
+
+def test_concat_many_tol_averages_merged_readings():
+    a = DataSet(pd.DataFrame({0: [1.0, 3.0, 5.0]}, index=[0.0, 0.01, 1.0]))
+    b = DataSet(pd.DataFrame({0: [2.0, 4.0]}, index=[0.02, 1.03]))
+
+    ds = DataSet.concat_many([a, b], tol=0.05)
+
+    assert ds.data.index.tolist() == [0.0, 1.0]
+    assert ds.data[0].tolist() == [2.0, 5.0]
+    assert ds.data[1].tolist() == [2.0, 4.0]
+
+
+def test_concat_many_tol_ignores_missing_readings():
+    a = DataSet(
+        pd.DataFrame({0: [np.nan, 3.0], 1: [np.nan, np.nan]}, index=[0.0, 0.01])
+    )
+
+    ds = DataSet.concat_many([a], tol=0.05)
+
+    assert ds.data[0].tolist() == [3.0]
+    assert np.isnan(ds.data[1].values).all()
+
+
+def test_concat_many_union_of_times():
+    a = DataSet(pd.DataFrame({0: [1.0, 2.0]}, index=[0.0, 1.0]))
+    b = DataSet(pd.DataFrame({0: [3.0, 4.0]}, index=[1.0, 2.0]))
+
+    ds = DataSet.concat_many([a, b])
+
+    assert ds.data.index.tolist() == [0.0, 1.0, 2.0]
+    np.testing.assert_array_equal(
+        ds.data.values, [[1.0, np.nan], [2.0, 3.0], [np.nan, 4.0]]
+    )
+
+
+def test_build_averages_repeated_times():
+    data = pd.DataFrame(
+        {0: [1.0, 2.0, 4.0, 5.0], 1: [0.0, 1.0, np.nan, 2.0]}, index=[0, 1, 1, 2]
+    )
+    ds = DataSet(data, pd.DataFrame({"strain": ["a", "b"]}))
+
+    x, y, _, _ = ds.build(covariates=["strain"])
+
+    assert x[:, 0].astype(float).tolist() == [0, 0, 1, 1, 2, 2]
+    assert x[:, 1].tolist() == ["a", "b"] * 3
+    np.testing.assert_array_equal(
+        y,
+        [
+            [1.0, np.nan],
+            [np.nan, 0.0],
+            [3.0, np.nan],
+            [np.nan, 1.0],
+            [5.0, np.nan],
+            [np.nan, 2.0],
+        ],
+    )
+
+
+def test_build_matches_curves_to_covariates():
+    data = pd.DataFrame(np.arange(6.0).reshape(2, 3), index=[0.0, 1.0])
+    ds = DataSet(data, pd.DataFrame({"strain": ["b", "a", "b"]}))
+
+    x, y, _, _ = ds.build(covariates=["strain"])
+
+    assert x[:, 1].tolist() == ["a", "b", "a", "b"]
+    np.testing.assert_array_equal(
+        y,
+        [
+            [np.nan, 1.0, np.nan],
+            [0.0, np.nan, 2.0],
+            [np.nan, 4.0, np.nan],
+            [3.0, np.nan, 5.0],
+        ],
+    )
+
+
+def write(d, values):
+    data = pd.DataFrame(values, columns=["time", "a", "b"])
+    data.to_csv(os.path.join(d, "data.csv"), index=False)
+    pd.DataFrame({"strain": ["x", "y"]}).to_csv(
+        os.path.join(d, "meta.csv"), index=False
+    )
+
+
+def test_sidecar_is_used_until_source_changes(tmp_path):
+    d = str(tmp_path)
+    write(d, [[0.0, 1.0, 2.0], [1.0, 3.0, 4.0]])
+
+    first = DataSet.fromDirectory(d)
+    assert os.path.exists(os.path.join(d, CACHE, "source.json"))
+
+    cached = DataSet.fromDirectory(d)
+    assert isinstance(cached.data.values, np.ndarray)
+    assert cached == first
+
+    # same size, so only the content hash tells the files apart
+    write(d, [[0.0, 1.0, 2.0], [1.0, 3.0, 5.0]])
+    stat = os.stat(os.path.join(d, "data.csv"))
+    os.utime(
+        os.path.join(d, "data.csv"), ns=(stat.st_atime_ns, stat.st_mtime_ns + int(1e9))
+    )
+
+    changed = DataSet.fromDirectory(d)
+    assert changed.data.values[1, 1] == 5.0
+    assert DataSet.fromDirectory(d).data.values[1, 1] == 5.0
+
+
+def test_unreadable_sidecar_falls_back_to_csv(tmp_path):
+    d = str(tmp_path)
+    write(d, [[0.0, 1.0, 2.0], [1.0, 3.0, 4.0]])
+    first = DataSet.fromDirectory(d)
+
+    with open(os.path.join(d, CACHE, "meta.pkl"), "wb") as fh:
+        fh.write(b"not a pickle")
+
+    assert DataSet.fromDirectory(d) == first
+    assert DataSet.fromBinary(os.path.join(d, CACHE)) == first
@@ -0,0 +1,60 @@
+import numpy as np
+
+from phenom import derivative
+
+
+def dense(x, f, alpha, lengthscale):
+    """Conditional mean and covariance of df given f, from the joint covariance."""
+    diff = x[:, None] - x[None, :]
+    K = alpha ** 2 * np.exp(-0.5 * diff ** 2 / lengthscale ** 2)
+
+    # cov(df(x), f(x')) and cov(df(x), df(x'))
+    dK = -diff / lengthscale ** 2 * K
+    ddK = (1 - diff ** 2 / lengthscale ** 2) / lengthscale ** 2 * K
+
+    solve = np.linalg.solve(K + 1e-8 * np.eye(x.shape[0]), dK.T).T
+    return solve @ f, ddK - solve @ dK.T
+
+
+def test_conditional_mean_and_covariance():
+    rng = np.random.RandomState(0)
+    x = np.linspace(0, 1, 6)
+    alpha, lengthscale = 1.3, 0.4
+    f = np.sin(3 * x)
+
+    S = 20000
+    df = derivative.sample(
+        x,
+        np.tile(f, (S, 2, 1)),
+        np.full((S, 1), alpha),
+        np.full((S, 1), lengthscale),
+        [0, 0],
+        functions=[1],
+        random_state=rng,
+    )
+    assert df.shape == (S, 1, 6)
+
+    mean, cov = dense(x, f, alpha, lengthscale)
+
+    np.testing.assert_allclose(df[:, 0].mean(0), mean, atol=0.05)
+    np.testing.assert_allclose(np.cov(df[:, 0].T), cov, atol=0.1 * np.abs(cov).max())
+
+
+def test_priors_select_hyperparameters():
+    rng = np.random.RandomState(1)
+    x = np.linspace(0, 1, 5)
+    f = np.cos(2 * x)
+
+    S = 20000
+    df = derivative.sample(
+        x,
+        np.tile(f, (S, 2, 1)),
+        np.tile([1.0, 2.0], (S, 1)),
+        np.tile([0.3, 0.6], (S, 1)),
+        [1, 0],
+        random_state=rng,
+    )
+
+    for k, (a, l) in enumerate([(2.0, 0.6), (1.0, 0.3)]):
+        mean, _ = dense(x, f, a, l)
+        np.testing.assert_allclose(df[:, k].mean(0), mean, atol=0.05)
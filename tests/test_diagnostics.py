@@ -0,0 +1,59 @@
+import numpy as np
+
+from phenom import diagnostics
+
+
+def ar1(phi, iterations, chains, seed=0):
+    """Stationary AR(1) chains, (iterations, chains), with unit marginal variance."""
+    rng = np.random.RandomState(seed)
+    noise = rng.normal(0, np.sqrt(1 - phi ** 2), (iterations, chains))
+
+    draws = np.empty((iterations, chains))
+    draws[0] = rng.normal(size=chains)
+    for t in range(1, iterations):
+        draws[t] = phi * draws[t - 1] + noise[t]
+    return draws
+
+
+def test_ess_of_ar1():
+    phi, iterations, chains = 0.5, 5000, 4
+    draws = ar1(phi, iterations, chains)
+
+    # integrated autocorrelation time of AR(1) is (1 + phi) / (1 - phi)
+    expected = iterations * chains * (1 - phi) / (1 + phi)
+
+    np.testing.assert_allclose(diagnostics.ess(draws), expected, rtol=0.1)
+
+
+def test_ess_of_independent_draws():
+    draws = np.random.RandomState(1).normal(size=(2000, 4))
+
+    np.testing.assert_allclose(diagnostics.ess(draws), 8000, rtol=0.1)
+
+
+def test_rhat():
+    draws = ar1(0.5, 2000, 4)
+    assert abs(diagnostics.rhat(draws) - 1) < 0.01
+
+    # one chain stuck elsewhere
+    draws[:, 0] += 3
+    assert diagnostics.rhat(draws) > 1.5
+
+
+def test_vectorized_over_trailing_dimensions():
+    draws = np.stack([ar1(0.5, 1000, 4, seed=s) for s in range(3)], axis=-1)
+
+    ess = diagnostics.ess(draws)
+    assert ess.shape == (3,)
+    for i in range(3):
+        np.testing.assert_allclose(ess[i], diagnostics.ess(draws[..., i]))
+
+
+def test_target_check():
+    draws = {"sigma": ar1(0.5, 2000, 4)}
+
+    met = diagnostics.Target(ess=400, pars=("sigma",)).check(draws)
+    unmet = diagnostics.Target(ess=10 ** 5, pars=("sigma",)).check(draws)
+
+    assert met["converged"] and not unmet["converged"]
+    assert met["ess_sigma"] == unmet["ess_sigma"]
@@ -0,0 +1,76 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from phenom import posterior
+
+
+def samples(draws=30):
+    rng = np.random.RandomState(0)
+    return {
+        "f": rng.normal(size=(draws, 3, 5)),
+        "alpha": rng.gamma(1, size=(draws, 2)),
+        "sigma": rng.gamma(1, size=draws),
+    }
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_round_trip(tmp_path, compress):
+    samp = samples()
+    adaptation = {"stepsize": [0.1, 0.2], "inv_metric": [[1.0], [2.0]]}
+    posterior.save(
+        samp,
+        str(tmp_path),
+        (0, 48),
+        (1.0, 2.0),
+        compress=compress,
+        chunk=7,
+        adaptation=adaptation,
+    )
+
+    post = posterior.Posterior(str(tmp_path))
+    assert post.draws == 30
+    assert post.index["adaptation"] == adaptation
+
+    loaded = posterior.load(str(tmp_path))
+    for name, value in samp.items():
+        np.testing.assert_array_equal(loaded[name], value)
+
+    # only some draws, and one function
+    np.testing.assert_array_equal(post.read("f", slice(5, 20)), samp["f"][5:20])
+    np.testing.assert_array_equal(
+        post.read("f", [0, 29], function=2), samp["f"][[0, 29], 2]
+    )
+
+    native = samp["f"] * 2.0
+    native[:, 0] += 1.0
+    np.testing.assert_allclose(loaded["f-native"], native)
+
+
+def test_dtype(tmp_path):
+    samp = samples()
+    posterior.save(samp, str(tmp_path), dtype=np.float32)
+
+    loaded = posterior.load(str(tmp_path))
+    assert loaded["f"].dtype == np.float32
+    np.testing.assert_allclose(loaded["f"], samp["f"], rtol=1e-6)
+
+
+def test_save_over_earlier_posterior(tmp_path):
+    posterior.save(samples(), str(tmp_path))
+    posterior.save({"sigma": np.ones(4)}, str(tmp_path), compress=True)
+
+    assert sorted(os.listdir(str(tmp_path))) == ["index.json", "sigma.npz"]
+    assert list(posterior.load(str(tmp_path))) == ["sigma"]
+
+
+def test_pickled_posterior(tmp_path):
+    samp = samples()
+    p = str(tmp_path / "posterior_0.pkl")
+    with open(p, "wb") as fh:
+        pickle.dump(samp, fh)
+
+    assert posterior.path(str(tmp_path), 0) == p
+    np.testing.assert_array_equal(posterior.load(p)["alpha"], samp["alpha"])